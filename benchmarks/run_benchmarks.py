@@ -0,0 +1,364 @@
+# run_benchmarks.py
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from synthetic_corpus import generate_corpus, generate_queries, make_document, CATEGORIES
+
+STAGES = ("ingest", "retrieval", "recall", "enhance", "metrics")
+TABLE_STAGES = ("retrieval", "recall", "enhance")  # Stages that search the ingested table
+DEFAULT_CONCURRENCY = "1,4,16"
+DEFAULT_SEARCH_MODES = "vector,hybrid"
+DEFAULT_EXPECTED = "Provide a clear summary of employee benefits, including types of benefits, eligibility, and any prerequisites."
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(pct / 100 * len(sorted_values))))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def latency_summary(latencies, wall_seconds):
+    latencies = sorted(latencies)
+    return {
+        "count": len(latencies),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 3) if latencies else 0.0,
+        "max_ms": round(latencies[-1] * 1000, 3) if latencies else 0.0,
+        "throughput_per_sec": round(len(latencies) / wall_seconds, 2) if wall_seconds > 0 else 0.0
+    }
+
+
+def measure(fn, items, concurrency):
+    """Call `fn` on every item from `concurrency` threads and summarize per-call latency."""
+    def timed(item):
+        started = time.perf_counter()
+        fn(item)
+        return time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        latencies = list(executor.map(timed, items))
+    return latency_summary(latencies, time.perf_counter() - started)
+
+
+def measure_async(afn, items, levels):
+    """Await `afn` on every item with at most `level` calls in flight, for each concurrency level.
+
+    This is how the async endpoints serve requests: one event loop, with inference
+    and searches overlapping on the service's executors rather than on caller threads.
+    """
+    async def run_level(level):
+        semaphore = asyncio.Semaphore(level)
+
+        async def timed(item):
+            async with semaphore:
+                started = time.perf_counter()
+                await afn(item)
+                return time.perf_counter() - started
+
+        started = time.perf_counter()
+        latencies = await asyncio.gather(*(timed(item) for item in items))
+        return latency_summary(latencies, time.perf_counter() - started)
+
+    async def run_all():
+        # One loop for every level, since the async table and micro-batcher stay bound to it
+        return {f"async_concurrency_{level}": await run_level(level) for level in levels}
+
+    return asyncio.run(run_all())
+
+
+def require_rows():
+    """Exit instead of benchmarking searches over an empty table."""
+    from db_config import collection
+
+    rows = collection.count_rows()
+    if rows == 0:
+        sys.exit(
+            "The embeddings table in the workdir is empty: include the ingest stage, "
+            "or pass --workdir of an earlier run that ingested a corpus."
+        )
+    return rows
+
+
+def setup_environment(workdir, llm_latency_ms, token_latency_ms, embed_backend=None, embed_threads=None):
+    """Point the services at a scratch directory and the offline LLM before importing them."""
+    os.makedirs(workdir, exist_ok=True)
+    if embed_backend:
+        os.environ["EMBED_BACKEND"] = embed_backend
+    if embed_threads:
+        os.environ["EMBED_THREADS"] = str(embed_threads)
+    os.environ["LLM_BACKEND"] = "fake"
+    os.environ["FAKE_LLM_LATENCY_MS"] = str(llm_latency_ms)
+    os.environ["FAKE_LLM_TOKEN_LATENCY_MS"] = str(token_latency_ms)
+    os.environ["LLM_CACHE_PATH"] = os.path.join(workdir, "llm_cache.sqlite")
+    # db_config opens ./lance_db, so the benchmark table never touches the real one
+    os.chdir(workdir)
+    sys.path[:0] = [os.path.join(REPO_ROOT, "rag_service"), os.path.join(REPO_ROOT, "main_app")]
+
+
+def bench_ingest(corpus_dir, args):
+    from db_config import collection
+    from embed_documents import process_documents
+
+    stats = process_documents(
+        directory=corpus_dir,
+        write_batch_size=args.write_batch_size,
+        encode_batch_size=args.encode_batch_size,
+        num_workers=args.num_workers,
+        num_processes=args.ingest_processes
+    )
+    stats["rows"] = collection.count_rows()
+    stats["chunks_per_sec"] = round(stats["chunks"] / stats["seconds"], 2) if stats["seconds"] else 0.0
+    return stats
+
+
+def bench_retrieval(queries, args):
+    from db_config import collection, embedding_cache, index_manager
+    from langchain_pipeline import LangChainRetrievalPipeline
+
+    # Embed every query up front so each concurrency level measures the same work
+    embedding_cache.encode(queries)
+    results = {"index": index_manager.status()}
+    for mode in args.search_modes:
+        pipeline = LangChainRetrievalPipeline(
+            collection, None, k=args.k, nprobes=args.nprobes, refine_factor=args.refine_factor,
+            use_semantic_cache=False, search_mode=mode
+        )
+        # Sync calls on caller threads, then the async path the /retrieve/ endpoints use
+        results[mode] = {
+            f"concurrency_{level}": measure(pipeline.retrieve, queries, level) for level in args.concurrency
+        }
+        results[mode].update(measure_async(pipeline.aretrieve, queries, args.concurrency))
+    return results
+
+
+def bench_recall(queries, args):
+    """Recall@k of the ANN index (with the configured nprobes/refine) against an exact scan."""
+    from db_config import collection, embedding_cache, index_manager
+
+    recalls = []
+    for query_embedding in embedding_cache.encode(queries):
+        query = index_manager.apply_search_params(collection.search(query_embedding), args.nprobes, args.refine_factor)
+        approximate = {row["text_id"] for row in query.limit(args.k).to_list()}
+        exact = [row["text_id"] for row in collection.search(query_embedding).bypass_vector_index().limit(args.k).to_list()]
+        if exact:
+            recalls.append(len(approximate.intersection(exact)) / len(exact))
+
+    return {
+        "k": args.k,
+        "index_type": index_manager.status()["index_type"],
+        "nprobes": args.nprobes,
+        "refine_factor": args.refine_factor,
+        "queries": len(recalls),
+        "recall_at_k": round(sum(recalls) / len(recalls), 4) if recalls else None,
+        "min_recall": round(min(recalls), 4) if recalls else None
+    }
+
+
+def bench_enhance(queries, args):
+    from db_config import collection
+    from langchain_pipeline import LangChainRetrievalPipeline
+    from rag_common.llm_backends import create_llm
+
+    pipeline = LangChainRetrievalPipeline(
+        collection, create_llm(backend="fake", cache=False), k=args.k, nprobes=args.nprobes,
+        refine_factor=args.refine_factor, use_semantic_cache=False
+    )
+    return {
+        "llm_latency_ms": args.llm_latency_ms,
+        "token_latency_ms": args.token_latency_ms,
+        **{f"concurrency_{level}": measure(pipeline.retrieve_and_enhance, queries, level) for level in args.concurrency},
+        **measure_async(pipeline.aretrieve_and_enhance, queries, args.concurrency)
+    }
+
+
+class LocalEmbeddingClient:
+    """Stands in for RAGServiceClient so relevance is embedded in-process, not over HTTP."""
+
+    def get_embeddings(self, texts):
+        from db_config import embedding_cache
+        return embedding_cache.encode(list(texts)).tolist()
+
+
+def bench_metrics(args):
+    """Cost of each PromptQualityTester metric, per response and for the batched path."""
+    import random
+    from prompt_quality_tester import PromptQualityTester
+
+    tester = PromptQualityTester(None, LocalEmbeddingClient(), use_cache=False, backend="fake")
+    rng = random.Random(args.seed)
+    responses = [
+        make_document(rng, CATEGORIES[i % len(CATEGORIES)], i)[1]["content"] for i in range(args.metric_samples)
+    ]
+    tester.evaluate_response("", DEFAULT_EXPECTED, responses[0])  # Load spaCy and the embedding model
+
+    def per_response(actual):
+        doc = tester._parse(actual)
+        steps = {
+            "parse": lambda: tester._parse(actual),
+            "clarity": lambda: tester._measure_clarity(actual),
+            "relevance": lambda: tester._measure_relevance(DEFAULT_EXPECTED, actual),
+            "completeness": lambda: tester._measure_completeness(DEFAULT_EXPECTED, doc),
+            "consistency": lambda: tester._measure_consistency(doc),
+            "conciseness": lambda: tester._measure_conciseness(actual),
+            "evaluate_response": lambda: tester.evaluate_response("", DEFAULT_EXPECTED, actual)
+        }
+        timings = {}
+        for name, step in steps.items():
+            started = time.perf_counter()
+            step()
+            timings[name] = time.perf_counter() - started
+        return timings
+
+    samples = [per_response(actual) for actual in responses]
+    results = {name: latency_summary([s[name] for s in samples], sum(s[name] for s in samples)) for name in samples[0]}
+
+    cases = [{"prompt": actual, "expected": DEFAULT_EXPECTED} for actual in responses]
+    started = time.perf_counter()
+    tester.test_prompts(cases, batch_size=args.metric_batch_size)
+    seconds = time.perf_counter() - started
+    results["test_prompts"] = {
+        "cases": len(cases),
+        "seconds": round(seconds, 3),
+        "per_case_ms": round(seconds / len(cases) * 1000, 3)
+    }
+    return results
+
+
+def flatten(results, prefix=""):
+    """Map dotted paths to every numeric leaf, for comparing two result files."""
+    flat = {}
+    for key, value in results.items():
+        path = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{path}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[path] = value
+    return flat
+
+
+def compare(baseline_path, results):
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = flatten(json.load(f)["results"])
+    for path, value in flatten(results).items():
+        old = baseline.get(path)
+        if old:
+            print(f"{path}: {old} -> {value} ({(value - old) / old:+.1%})")
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=REPO_ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark ingestion, retrieval and prompt metrics offline")
+    parser.add_argument("--stages", default=",".join(STAGES), help=f"Comma-separated subset of {STAGES}")
+    parser.add_argument("--docs", type=int, default=5_000, help="Synthetic documents (~2 chunks each)")
+    parser.add_argument("--corpus", help="Existing corpus directory instead of a generated one")
+    parser.add_argument("--workdir", help="Scratch directory for the table and caches (default: a new temp dir)")
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--baseline", help="Earlier result file to print relative changes against")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--nprobes", type=int)
+    parser.add_argument("--refine-factor", type=int)
+    parser.add_argument("--concurrency", default=DEFAULT_CONCURRENCY)
+    parser.add_argument("--search-modes", default=DEFAULT_SEARCH_MODES)
+    parser.add_argument("--write-batch-size", type=int, default=1024)
+    parser.add_argument("--encode-batch-size", type=int, default=64)
+    parser.add_argument("--num-workers", type=int, default=8)
+    parser.add_argument("--ingest-processes", type=int, default=1, help="Embedding processes for the ingest stage")
+    parser.add_argument("--embed-backend", help="torch, torch_int8, onnx or onnx_int8 (default: EMBED_BACKEND or torch)")
+    parser.add_argument("--embed-threads", type=int)
+    parser.add_argument("--llm-latency-ms", type=float, default=200.0, help="Fake LLM delay before the first token")
+    parser.add_argument("--token-latency-ms", type=float, default=0.0, help="Fake LLM delay per token")
+    parser.add_argument("--metric-samples", type=int, default=100)
+    parser.add_argument("--metric-batch-size", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    args.stages = [stage for stage in args.stages.split(",") if stage]
+    unknown = set(args.stages) - set(STAGES)
+    if unknown:
+        parser.error(f"Unknown stages {sorted(unknown)}, expected some of {STAGES}")
+    if not args.workdir and "ingest" not in args.stages and set(args.stages) & set(TABLE_STAGES):
+        parser.error(f"Stages {TABLE_STAGES} need an ingested table: add the ingest stage or pass --workdir")
+    args.concurrency = [int(level) for level in args.concurrency.split(",")]
+    args.search_modes = [mode for mode in args.search_modes.split(",") if mode]
+    return args
+
+
+def main():
+    args = parse_args()
+    output = os.path.abspath(args.output)
+    baseline = os.path.abspath(args.baseline) if args.baseline else None
+    workdir = os.path.abspath(args.workdir or tempfile.mkdtemp(prefix="rag_bench_"))
+    corpus_dir = os.path.abspath(args.corpus or os.path.join(workdir, "corpus"))
+
+    if "ingest" in args.stages and not args.corpus:
+        started = time.perf_counter()
+        generate_corpus(corpus_dir, args.docs, seed=args.seed)
+        print(f"Generated {args.docs} documents in {time.perf_counter() - started:.1f}s")
+
+    setup_environment(workdir, args.llm_latency_ms, args.token_latency_ms, args.embed_backend, args.embed_threads)
+    queries = generate_queries(args.queries, seed=args.seed + 1)
+
+    results = {}
+    for stage in args.stages:
+        if stage in TABLE_STAGES:
+            require_rows()
+        print(f"Running {stage} benchmark...")
+        if stage == "ingest":
+            results[stage] = bench_ingest(corpus_dir, args)
+        elif stage == "retrieval":
+            results[stage] = bench_retrieval(queries, args)
+        elif stage == "recall":
+            results[stage] = bench_recall(queries, args)
+        elif stage == "enhance":
+            results[stage] = bench_enhance(queries, args)
+        elif stage == "metrics":
+            results[stage] = bench_metrics(args)
+
+    report = {
+        "timestamp": datetime.now().isoformat(),
+        "git_commit": git_commit(),
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count()
+        },
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "baseline")},
+        "workdir": workdir,
+        "results": results
+    }
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote results to {output}")
+
+    if baseline:
+        compare(baseline, results)
+
+
+if __name__ == "__main__":
+    main()
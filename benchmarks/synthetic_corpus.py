@@ -0,0 +1,93 @@
+# synthetic_corpus.py
+import argparse
+import json
+import os
+import random
+from datetime import date, timedelta
+
+# Shapes follow generated_hr_docs: one JSON file per document with a `content`
+# field, named with the category prefix that ingestion derives metadata from
+CATEGORIES = ("benefits", "faqs", "expense", "internal_memos", "job_descriptions", "employee_handbook")
+
+TOPICS = (
+    "health insurance", "paid time off", "parental leave", "retirement plans", "stock options",
+    "remote work", "expense reimbursement", "travel policy", "performance reviews", "training budget",
+    "gym memberships", "childcare support", "code of conduct", "data security", "onboarding",
+    "overtime", "transportation allowance", "professional development", "workplace safety", "promotions"
+)
+SUBJECTS = ("Employees", "Managers", "New hires", "Full-time staff", "Contractors", "Team leads", "The HR team")
+ACTIONS = (
+    "are eligible for", "must submit requests for", "should review the guidelines on", "can apply for",
+    "are reminded about changes to", "will receive updates on", "need manager approval for", "may opt out of"
+)
+DETAILS = (
+    "within 30 days of the start date", "through the HR portal", "before the end of the quarter",
+    "according to the company handbook", "after completing the probation period", "with supporting receipts",
+    "during the annual enrollment window", "subject to local regulations", "at no additional cost",
+    "as described in the benefits guide"
+)
+QUESTION_STARTS = ("How do I", "When can I", "Who approves", "What is the policy for", "Where can I find details on")
+
+DEFAULT_SENTENCES_PER_DOC = 12  # About two 128-word chunks per document with the default chunker
+START_DATE = date(2023, 1, 1)
+
+
+def make_sentence(rng, topic=None):
+    topic = topic or rng.choice(TOPICS)
+    return f"{rng.choice(SUBJECTS)} {rng.choice(ACTIONS)} {topic} {rng.choice(DETAILS)}."
+
+
+def make_document(rng, category, index, sentences_per_doc=DEFAULT_SENTENCES_PER_DOC):
+    """Return `(file_name, document)` for one synthetic HR document."""
+    topic = rng.choice(TOPICS)
+    # Most sentences stay on the document's topic so retrieval has something to find
+    sentences = [make_sentence(rng, topic if rng.random() < 0.7 else None) for _ in range(sentences_per_doc)]
+    doc_date = (START_DATE + timedelta(days=rng.randrange(730))).isoformat()
+    document = {"content": " ".join(sentences)}
+    if category in ("internal_memos", "expense"):
+        document["date"] = doc_date
+    if category == "faqs":
+        document["question"] = f"{rng.choice(QUESTION_STARTS)} {topic}?"
+    return f"{category}_synthetic_{index}.json", document
+
+
+def generate_corpus(directory, num_docs, sentences_per_doc=DEFAULT_SENTENCES_PER_DOC, seed=0, files_per_dir=10_000):
+    """Write `num_docs` synthetic documents under `directory`.
+
+    Output is fully determined by `seed`, so runs on different machines or
+    commits ingest the same corpus. Files are spread over subdirectories of
+    `files_per_dir` to keep directory listings fast at large scales.
+
+    Returns:
+        int: Number of documents written.
+    """
+    rng = random.Random(seed)
+    for i in range(num_docs):
+        subdir = os.path.join(directory, f"part_{i // files_per_dir:04d}")
+        if i % files_per_dir == 0:
+            os.makedirs(subdir, exist_ok=True)
+        file_name, document = make_document(rng, CATEGORIES[i % len(CATEGORIES)], i, sentences_per_doc)
+        with open(os.path.join(subdir, file_name), "w", encoding="utf-8") as f:
+            json.dump(document, f)
+    return num_docs
+
+
+def generate_queries(num_queries, seed=1):
+    """Return `num_queries` deterministic user questions about the corpus topics."""
+    rng = random.Random(seed)
+    return [f"{rng.choice(QUESTION_STARTS)} {rng.choice(TOPICS)} {rng.choice(DETAILS)}?" for _ in range(num_queries)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic HR document corpus")
+    parser.add_argument("directory")
+    parser.add_argument("--docs", type=int, default=5_000, help="Documents to write (~2 chunks each)")
+    parser.add_argument("--sentences", type=int, default=DEFAULT_SENTENCES_PER_DOC)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    generate_corpus(args.directory, args.docs, args.sentences, args.seed)
+    print(f"Wrote {args.docs} documents to {args.directory}")
+
+
+if __name__ == "__main__":
+    main()
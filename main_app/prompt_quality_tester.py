@@ -1,40 +1,99 @@
 # prompt_quality_tester.py
+import json
+import logging
+from itertools import islice
 import spacy
 import numpy as np
-from langchain.llms import OpenAI
 from textblob import TextBlob
 import plotly.graph_objects as go
 from datetime import datetime
-from typing import Dict
+from typing import Dict, FrozenSet, Iterable, List, Optional, Union
+from collections import OrderedDict
+from functools import lru_cache
+from spacy.language import Language
+from spacy.tokens import Doc
 from rag_service_client import RAGServiceClient  # Import RAGServiceClient for integration
+from rag_common.generation_cache import get_generation_cache
+from rag_common.llm_backends import create_llm, DEFAULT_BACKEND
+from rag_common.stage_timing import StageTimer
 from textstat import flesch_reading_ease
 from sklearn.metrics.pairwise import cosine_similarity
 
+SPACY_MODEL = 'en_core_web_sm'
+# spaCy components none of the metrics read (noun chunks, entities, sentences and similarity only)
+UNUSED_PIPES = ("lemmatizer",)
+# Expected patterns whose key phrases are kept parsed
+EXPECTED_CACHE_SIZE = 256
+
+@lru_cache(maxsize=None)
+def load_nlp(model: str = SPACY_MODEL) -> Language:
+    """Load the spaCy pipeline once per process, without the components the metrics don't use"""
+    return spacy.load(model, exclude=list(UNUSED_PIPES))
+
+
+def load_test_cases(path: str) -> List[Dict]:
+    """Load prompt/expected pairs from a JSON list or a JSON-lines file"""
+    with open(path, "r", encoding="utf-8") as f:
+        if path.endswith(".jsonl"):
+            return [json.loads(line) for line in f if line.strip()]
+        return json.load(f)
+
+
+def _batched(items: Iterable, size: int):
+    iterator = iter(items)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
 class PromptQualityTester:
-    def __init__(self, api_key: str, rag_client: RAGServiceClient):
-        """Initialize the tester with OpenAI API key and RAG client"""
-        self.llm = OpenAI(api_key=api_key)
-        self.nlp = spacy.load('en_core_web_sm')
+    def __init__(self, api_key: str, rag_client: RAGServiceClient, use_cache: bool = True,
+                 backend: str = DEFAULT_BACKEND):
+        """Initialize the tester with OpenAI API key and RAG client.
+
+        With `use_cache`, generations are read from and written to the SQLite cache
+        shared with the RAG service, so identical prompts are never sent twice.
+        `backend` selects the LLM (see `llm_backends.LLM_BACKENDS`); "fake" runs
+        offline without an API key.
+        """
+        self.generation_cache = get_generation_cache() if use_cache else None
+        self.llm = create_llm(api_key, backend, cache=self.generation_cache or False)
+        self._nlp = None
         self.history = []
         self.rag_client = rag_client
+        self._expected_cache = OrderedDict()
 
-    def test_prompt(self, prompt: str, expected_pattern: str) -> Dict:
+    @property
+    def nlp(self) -> Language:
+        """spaCy pipeline, loaded on first use and shared by every tester in the process"""
+        if self._nlp is None:
+            self._nlp = load_nlp()
+        return self._nlp
+
+    def test_prompt(self, prompt: str, expected_pattern: str, response: Optional[str] = None) -> Dict:
         """Test a prompt and return quality metrics.
 
         Args:
             prompt (str): The prompt to be tested (either basic or enhanced).
             expected_pattern (str): The expected structure or content for comparison.
             is_enhanced (bool): Flag to indicate if the prompt was enhanced via RAG pipeline.
+            response (str): The LLM's response to `prompt` if already generated (e.g. streamed
+                by the RAG service); it is scored as-is instead of generating a second one.
 
         Returns:
-            Dict: A dictionary containing metrics, prompt, response, and other details.
+            Dict: A dictionary containing metrics, prompt, response, per-stage `timings` (ms) and other details.
         """
+        timer = StageTimer("prompt_quality")
         try:
             # Generate response from LLM
-            response = self.llm.generate([prompt]).generations[0][0].text
+            if response is None:
+                with timer.stage("llm"):
+                    response = self.llm.generate([prompt]).generations[0][0].text
             
             # Calculate metrics
-            metrics = self.evaluate_response(prompt, expected_pattern, response)
+            metrics = self.evaluate_response(prompt, expected_pattern, response, timer)
             
             # Save result
             result = {
@@ -42,24 +101,140 @@ class PromptQualityTester:
                 'prompt': prompt,
                 'expected': expected_pattern,
                 'response': response,
-                'metrics': metrics
+                'metrics': metrics,
+                'timings': timer.as_ms()
             }
+            logging.debug(f"Tested prompt in {result['timings']} ms per stage")
             self.history.append(result)
             return result
             
         except Exception as e:
             return {"error": f"Error testing prompt: {str(e)}"}
         
-    def evaluate_response(self, prompt: str, expected: str, actual: str) -> Dict:
-        """Calculate quality metrics for the response"""
+    def test_prompts(self, cases: Union[str, Iterable[Dict]], results_path: Optional[str] = None,
+                     batch_size: int = 20, nlp_batch_size: int = 64, n_process: int = 1) -> List[Dict]:
+        """Test a suite of prompts in batches and return one result per case.
+
+        Each batch makes one `llm.generate` call for all its prompts, parses every
+        response with `nlp.pipe`, fetches all embeddings in one request and scores
+        relevance as a single matrix operation. Results are appended to
+        `results_path` as JSON lines as soon as each batch finishes.
+
+        Args:
+            cases: Path to a .json/.jsonl file, or an iterable of dicts with `prompt` and `expected` keys.
+            results_path (str): Optional JSONL file that results are streamed to.
+            batch_size (int): Cases per LLM request.
+            nlp_batch_size (int): Texts per spaCy batch.
+            n_process (int): spaCy worker processes.
+
+        Returns:
+            List[Dict]: Results in the same shape as `test_prompt`, or `{"error": ...}` per failed case.
+            The `llm`, `parse` and `relevance` timings cover the case's whole batch.
+        """
+        if isinstance(cases, str):
+            cases = load_test_cases(cases)
+
+        results = []
+        results_file = open(results_path, "a", encoding="utf-8") if results_path else None
+        try:
+            for batch in _batched(cases, batch_size):
+                batch_results = self._test_batch(batch, nlp_batch_size, n_process)
+                results.extend(batch_results)
+                if results_file:
+                    for result in batch_results:
+                        results_file.write(json.dumps(result, default=float) + "\n")
+                    results_file.flush()
+        finally:
+            if results_file:
+                results_file.close()
+        return results
+
+    def _test_batch(self, cases: List[Dict], nlp_batch_size: int, n_process: int) -> List[Dict]:
+        """Generate, parse, embed and score one batch of cases
+
+        If batched relevance scoring fails, each case falls back to `_measure_relevance`,
+        which scores 0.0 on error as in `test_prompt`.
+        """
+        prompts = [case['prompt'] for case in cases]
+        expecteds = [case['expected'] for case in cases]
+        timer = StageTimer("prompt_quality_batch")
+        try:
+            with timer.stage("llm"):
+                generations = self.llm.generate(prompts).generations
+            responses = [generation[0].text for generation in generations]
+
+            with timer.stage("parse"):
+                disable = [pipe for pipe in UNUSED_PIPES if pipe in self.nlp.pipe_names]
+                docs = list(self.nlp.pipe(responses, batch_size=nlp_batch_size, n_process=n_process, disable=disable))
+
+            with timer.stage("relevance"):
+                try:
+                    relevances = self._batch_relevance(expecteds, responses)
+                except Exception as e:
+                    logging.warning(f"Batched relevance failed, scoring cases one by one: {e}")
+                    relevances = [self._measure_relevance(expected, response)
+                                  for expected, response in zip(expecteds, responses)]
+        except Exception as e:
+            return [{"error": f"Error testing prompt: {str(e)}", 'prompt': prompt} for prompt in prompts]
+
+        batch_timings = timer.as_ms()
+        results = []
+        for prompt, expected, response, doc, relevance in zip(prompts, expecteds, responses, docs, relevances):
+            case_timer = StageTimer("prompt_quality_batch")
+            result = {
+                'timestamp': datetime.now().isoformat(),
+                'prompt': prompt,
+                'expected': expected,
+                'response': response,
+                'metrics': self._score(expected, response, doc, relevance, case_timer),
+                'timings': {**batch_timings, **case_timer.as_ms()}
+            }
+            self.history.append(result)
+            results.append(result)
+        logging.debug(f"Tested batch of {len(cases)} prompts in {batch_timings} ms per batch stage")
+        return results
+
+    def _batch_relevance(self, expecteds: List[str], responses: List[str]) -> np.ndarray:
+        """Cosine similarity of each expected/response pair from one embedding request"""
+        unique_expected = list(dict.fromkeys(expecteds))
+        embeddings = np.asarray(self.rag_client.get_embeddings(unique_expected + responses), dtype=float)
+        embeddings /= np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+
+        expected_rows = [unique_expected.index(expected) for expected in expecteds]
+        expected_embeddings = embeddings[expected_rows]
+        response_embeddings = embeddings[len(unique_expected):]
+        return np.einsum('ij,ij->i', expected_embeddings, response_embeddings)
+
+    def evaluate_response(self, prompt: str, expected: str, actual: str, timer: Optional[StageTimer] = None) -> Dict:
+        """Calculate quality metrics for the response, recording each metric's cost on `timer`"""
+        timer = timer or StageTimer("prompt_quality")
+        # Parse the response once and share the Doc across every spaCy-based metric
+        with timer.stage("parse"):
+            actual_doc = self._parse(actual)
+        with timer.stage("relevance"):
+            relevance = self._measure_relevance(expected, actual)
+        return self._score(expected, actual, actual_doc, relevance, timer)
+
+    def _score(self, expected: str, actual: str, actual_doc: Doc, relevance: float,
+               timer: Optional[StageTimer] = None) -> Dict:
+        """Combine the per-metric scores for an already parsed and embedded response"""
+        timer = timer or StageTimer("prompt_quality")
+        with timer.stage("clarity"):
+            clarity = self._measure_clarity(actual)
+        with timer.stage("completeness"):
+            completeness = self._measure_completeness(expected, actual_doc)
+        with timer.stage("consistency"):
+            consistency = float(self._measure_consistency(actual_doc))
+        with timer.stage("conciseness"):
+            conciseness = float(self._measure_conciseness(actual))
         metrics = {
-            'clarity': self._measure_clarity(actual),
-            'relevance': self._measure_relevance(expected, actual),
-            'completeness': self._measure_completeness(expected, actual),
-            'consistency': self._measure_consistency(actual),
-            'conciseness': self._measure_conciseness(actual)
+            'clarity': clarity,
+            'relevance': float(relevance),
+            'completeness': completeness,
+            'consistency': consistency,
+            'conciseness': conciseness
         }
-        metrics['overall'] = np.mean(list(metrics.values()))
+        metrics['overall'] = float(np.mean(list(metrics.values())))
         return metrics
 
     def _measure_clarity(self, text: str) -> float:
@@ -70,39 +245,32 @@ class PromptQualityTester:
             # Normalize to a 0-1 scale (adjust as needed based on readability range)
             return max(0.0, min(1.0, readability_score / 100))
         except Exception as e:
-            print(f"Error calculating clarity: {e}")
+            logging.warning(f"Error calculating clarity: {e}")
             return 0.0
 
     def _measure_relevance(self, expected: str, actual: str) -> float:
         """Measure semantic similarity between expected and actual using embeddings"""
         try:
-            expected_embedding = self.rag_client.get_embedding(expected)  # Assuming embeddings can be fetched like this
-            actual_embedding = self.rag_client.get_embedding(actual)
+            expected_embedding, actual_embedding = self.rag_client.get_embeddings([expected, actual])
             similarity_score = cosine_similarity([expected_embedding], [actual_embedding])[0][0]
             return similarity_score
         except Exception as e:
-            print(f"Error calculating relevance: {e}")
+            logging.warning(f"Error calculating relevance: {e}")
             return 0.0
 
-    def _measure_completeness(self, expected: str, actual: str) -> float:
+    def _measure_completeness(self, expected: str, actual: Union[str, Doc]) -> float:
         """Measure if all expected elements are present"""
-        expected_chunks = set(chunk.text.lower() for chunk in self.nlp(expected).noun_chunks)
-        actual_chunks = set(chunk.text.lower() for chunk in self.nlp(actual).noun_chunks)
-        
-        expected_entities = set(ent.text.lower() for ent in self.nlp(expected).ents)
-        actual_entities = set(ent.text.lower() for ent in self.nlp(actual).ents)
-        
-        expected_keys = expected_chunks.union(expected_entities)
-        actual_keys = actual_chunks.union(actual_entities)
-        
+        expected_keys = self._expected_keys(expected)
+        actual_keys = self._key_phrases(self._as_doc(actual))
+
         if len(expected_keys) == 0:
             return 1.0
         return len(actual_keys.intersection(expected_keys)) / len(expected_keys)
 
 
-    def _measure_consistency(self, text: str) -> float:
+    def _measure_consistency(self, text: Union[str, Doc]) -> float:
         """Measure internal consistency of response"""
-        doc = self.nlp(text)
+        doc = self._as_doc(text)
         sentences = list(doc.sents)
         if len(sentences) <= 1:
             return 1.0
@@ -116,6 +284,32 @@ class PromptQualityTester:
         words = len(text.split())
         return min(1.0, 2.0 / (1 + np.exp(words / 100)))
 
+    def _parse(self, text: str) -> Doc:
+        """Run the spaCy pipeline once, skipping components no metric reads"""
+        return self.nlp(text, disable=[pipe for pipe in UNUSED_PIPES if pipe in self.nlp.pipe_names])
+
+    def _as_doc(self, text: Union[str, Doc]) -> Doc:
+        """Accept either raw text or an already parsed Doc"""
+        return text if isinstance(text, Doc) else self._parse(text)
+
+    def _key_phrases(self, doc: Doc) -> FrozenSet[str]:
+        """Lower-cased noun chunks and named entities of a parsed text"""
+        chunks = set(chunk.text.lower() for chunk in doc.noun_chunks)
+        entities = set(ent.text.lower() for ent in doc.ents)
+        return frozenset(chunks.union(entities))
+
+    def _expected_keys(self, expected: str) -> FrozenSet[str]:
+        """Key phrases of an expected pattern, memoized since the same patterns are reused across tests"""
+        keys = self._expected_cache.get(expected)
+        if keys is None:
+            keys = self._key_phrases(self._parse(expected))
+            self._expected_cache[expected] = keys
+            if len(self._expected_cache) > EXPECTED_CACHE_SIZE:
+                self._expected_cache.popitem(last=False)
+        else:
+            self._expected_cache.move_to_end(expected)
+        return keys
+
 def create_radar_chart(metrics: dict):
     """Create a radar chart of metrics"""
     # Remove overall score from radar chart
@@ -2,6 +2,39 @@
 import streamlit as st
 from prompt_quality_tester import PromptQualityTester, create_radar_chart
 from rag_service_client import RAGServiceClient
+from rag_common.llm_backends import DEFAULT_BACKEND
+
+
+# Document category searched for each task type (None searches every document)
+TASK_CATEGORIES = {
+    "Create a Tutorial": None,
+    "Explain Employee Benefits": "benefits",
+    "Summarize Employee Handbook Section": "employee_handbook",
+    "Answer a Frequently Asked Question (FAQ)": "faqs",
+    "Summarize Internal Memo": "internal_memos",
+    "Describe a Job Role": "job_descriptions",
+}
+
+
+@st.cache_resource
+def get_rag_client():
+    """Share one pooled RAG client across reruns and sessions."""
+    return RAGServiceClient()
+
+
+def get_tester(api_key, use_cache=True):
+    """Return this session's tester, rebuilt only when the API key or cache setting changes.
+
+    The RAG client and spaCy pipeline are shared process-wide; the test history
+    lives in session state, so it is private to each user and survives the cache toggle.
+    """
+    tester_key = (api_key, use_cache)
+    if st.session_state.get('tester_key') != tester_key:
+        st.session_state['tester'] = PromptQualityTester(api_key, get_rag_client(), use_cache=use_cache)
+        st.session_state['tester_key'] = tester_key
+    tester = st.session_state['tester']
+    tester.history = st.session_state.setdefault('test_history', [])
+    return tester
 
 
 def main():
@@ -9,7 +42,7 @@ def main():
     st.title("Prompt Quality Tester")
 
     # Initialize RAG client
-    rag_client = RAGServiceClient()
+    rag_client = get_rag_client()
 
     # Check if the embedding count is already in session state; if not, fetch it
     if 'embedding_count' not in st.session_state:
@@ -24,6 +57,8 @@ def main():
     # Sidebar for API key and instructions
     with st.sidebar:
         api_key = st.text_input("Enter OpenAI API Key:", type="password")
+        bypass_cache = st.checkbox("Bypass LLM response cache", value=False)
+        stream_response = st.checkbox("Stream LLM response", value=True)
 
         # Document Embedding Section
         st.subheader("Document Embedding")
@@ -73,13 +108,13 @@ def main():
         - **Conciseness**: Information density
         """)
 
-    if not api_key:
+    # Only the OpenAI backend needs a key; local and fake backends run without one
+    if not api_key and DEFAULT_BACKEND == "openai":
         st.warning("Please enter your OpenAI API key in the sidebar to continue.")
         return
 
-    # Initialize the RAG client and tester
-    rag_client = RAGServiceClient()
-    tester = PromptQualityTester(api_key, rag_client)
+    # Initialize the tester
+    tester = get_tester(api_key, use_cache=not bypass_cache)
 
     # Main interface
     col1, col2 = st.columns(2)
@@ -104,6 +139,8 @@ def main():
         }
 
 
+        filter_by_task = st.checkbox("Only retrieve documents matching the task type", value=True)
+
         prompt = st.text_area("Enter your prompt:", height=150)
         expected = st.text_area(
             "Enter expected response pattern:",
@@ -116,15 +153,43 @@ def main():
             with st.spinner("Testing prompt..."):
                 try:
                     # Retrieve enhanced prompt and LLM response using RAG client
-                    result = rag_client.enhanced_retrieve(prompt, api_key)
-
-                    # Display enhanced prompt
-                    st.subheader("Enhanced Prompt Submitted to LLM:")
-                    st.write(result['enhanced_prompt'])
-                    
-                    # Display LLM response
-                    st.subheader("LLM Response:")
-                    st.write(result['llm_response'])
+                    category = TASK_CATEGORIES[task_type] if filter_by_task else None
+                    filters = {"category": category} if category else None
+                    streamed_response = None
+
+                    if stream_response:
+                        # The prompt and documents arrive before the LLM starts, then tokens render live
+                        events = rag_client.enhanced_retrieve_stream(
+                            prompt,
+                            api_key,
+                            bypass_cache=bypass_cache,
+                            filters=filters
+                        )
+                        result = next(events)
+
+                        st.subheader("Enhanced Prompt Submitted to LLM:")
+                        st.write(result['enhanced_prompt'])
+
+                        st.subheader("LLM Response:")
+                        streamed_response = st.write_stream(
+                            event["text"] for event in events if event["event"] == "token"
+                        )
+                        result["llm_response"] = streamed_response
+                    else:
+                        result = rag_client.enhanced_retrieve(
+                            prompt,
+                            api_key,
+                            bypass_cache=bypass_cache,
+                            filters=filters
+                        )
+
+                        # Display enhanced prompt
+                        st.subheader("Enhanced Prompt Submitted to LLM:")
+                        st.write(result['enhanced_prompt'])
+
+                        # Display LLM response
+                        st.subheader("LLM Response:")
+                        st.write(result['llm_response'])
                     
                     # Display information about documents used
                     st.subheader("Documents Used to Enhance Prompt:")
@@ -134,8 +199,9 @@ def main():
                         st.write(f"Score: {doc['score']}")
                         st.write("---")
 
-                    # Perform quality testing on the enhanced prompt
-                    metrics_result = tester.test_prompt(result['enhanced_prompt'], expected)
+                    # Perform quality testing on the enhanced prompt, scoring the streamed
+                    # response instead of generating it a second time
+                    metrics_result = tester.test_prompt(result['enhanced_prompt'], expected, response=streamed_response)
 
                     # Check for errors in metrics result
                     if "error" in metrics_result:
@@ -157,6 +223,13 @@ def main():
                         for i, (metric, value) in enumerate(metrics_result['metrics'].items()):
                             if metric != 'overall':
                                 metrics_cols[i].metric(metric.capitalize(), f"{value:.2f}")
+
+                        if tester.generation_cache is not None:
+                            cache_stats = tester.generation_cache.stats()
+                            st.caption(
+                                f"LLM cache hit rate: {cache_stats['hit_rate']:.0%} "
+                                f"({cache_stats['hits']} hits, {cache_stats['misses']} misses)"
+                            )
                 
                 except Exception as e:
                     st.error(f"An error occurred during testing: {str(e)}")
@@ -1,67 +1,267 @@
 # rag_service_client.py
+import json
+import httpx
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+DEFAULT_BASE_URL = "http://localhost:8000"
+DEFAULT_TIMEOUT = (5, 120)  # (connect, read) seconds
+INGEST_TIMEOUT = (5, 1800)  # Embedding the whole corpus can take minutes
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF = 0.5  # Seconds, doubled on each retry
+DEFAULT_POOL_SIZE = 20
+
+
+def _json_or_raise(response, action):
+    """Return the decoded body of a successful response, otherwise raise with the server's message."""
+    if response.status_code == 200:
+        return response.json()
+    raise Exception(f"Failed to {action}: {response.text}")
+
+
+def _stream_event(line, action):
+    """Decode one NDJSON line of a streaming response, raising if the server reported an error."""
+    event = json.loads(line)
+    if event.get("event") == "error":
+        raise Exception(f"Failed to {action}: {event.get('detail')}")
+    return event
+
 
 class RAGServiceClient:
-    def __init__(self, base_url="http://localhost:8000"):
-        """Initialize the client with the RAG service base URL."""
+    def __init__(self, base_url=DEFAULT_BASE_URL, timeout=DEFAULT_TIMEOUT, retries=DEFAULT_RETRIES,
+                 backoff_factor=DEFAULT_BACKOFF, pool_size=DEFAULT_POOL_SIZE):
+        """Initialize the client with the RAG service base URL.
+
+        Requests share one pooled, keep-alive `requests.Session` and failed
+        connections are retried with exponential backoff. Read timeouts and
+        502/503/504 responses are retried for GET only: a POST may already have
+        stored rows, started an ingestion job or made a paid LLM call.
+        """
         self.base_url = base_url
+        self.timeout = timeout
+        self.session = requests.Session()
+        retry = Retry(
+            total=retries,
+            connect=retries,
+            # urllib3 applies read and status retries only to `allowed_methods`
+            read=retries,
+            status=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=frozenset(["GET", "HEAD", "OPTIONS"]),
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def close(self):
+        """Close the pooled connections."""
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _post(self, path, action, json=None, timeout=None):
+        response = self.session.post(f"{self.base_url}{path}", json=json, timeout=timeout or self.timeout)
+        return _json_or_raise(response, action)
+
+    def _get(self, path, action, timeout=None):
+        response = self.session.get(f"{self.base_url}{path}", timeout=timeout or self.timeout)
+        return _json_or_raise(response, action)
 
     def get_embedding(self, text):
         """Generate embedding for a given text."""
-        response = requests.post(f"{self.base_url}/embed/", json={"text": text})
-        if response.status_code == 200:
-            return response.json()["embedding"]
-        else:
-            raise Exception(f"Failed to get embedding: {response.text}")
+        return self._post("/embed/", "get embedding", {"text": text})["embedding"]
+
+    def get_embeddings(self, texts):
+        """Generate embeddings for many texts in one request."""
+        return self._post("/embed_batch/", "get embeddings", {"texts": list(texts)})["embeddings"]
 
     def store_embedding(self, text):
         """Store the embedding of the given text in the RAG service."""
-        response = requests.post(f"{self.base_url}/store/", json={"text": text})
-        if response.status_code == 200:
-            return response.json()
-        else:
-            raise Exception(f"Failed to store embedding: {response.text}")
-
-    def retrieve_similar(self, query):
-        """Retrieve items similar to the given query text."""
-        response = requests.post(f"{self.base_url}/retrieve/", json={"query": query})
-        if response.status_code == 200:
-            return response.json()["results"]
-        else:
-            raise Exception(f"Failed to retrieve similar items: {response.text}")
+        return self._post("/store/", "store embedding", {"text": text})
+
+    def retrieve_similar(self, query, k=5, **options):
+        """Retrieve items similar to the given query text, without an LLM call.
+
+        `options` are passed to `/retrieve/`, e.g. `metric`, `max_distance`,
+        `columns`, `include_vector` or `filters`.
+        """
+        return self._post("/retrieve/", "retrieve similar items", {"query": query, "k": k, **options})["results"]
+
+    def retrieve_similar_batch(self, queries, k=5, **options):
+        """Retrieve similar items for many queries in one request; returns one result list per query."""
+        return self._post(
+            "/retrieve_batch/",
+            "retrieve similar items",
+            {"queries": list(queries), "k": k, **options}
+        )["results"]
 
     def embed_all_documents(self):
         """Call the endpoint to embed all documents."""
-        response = requests.post(f"{self.base_url}/embed_all_documents/")
-        if response.status_code == 200:
-            return response.json()
-        else:
-            raise Exception(f"Failed to embed all documents: {response.text}")
+        return self._post("/embed_all_documents/", "embed all documents", timeout=INGEST_TIMEOUT)
 
     def clear_embeddings(self):
         """Call the endpoint to clear all embeddings."""
-        response = requests.post(f"{self.base_url}/clear_embeddings/")
-        if response.status_code == 200:
-            return response.json()
-        else:
-            raise Exception(f"Failed to clear embeddings: {response.text}")
+        return self._post("/clear_embeddings/", "clear embeddings")
 
     def check_embeddings(self):
         """Call the endpoint to check the number of embeddings."""
-        response = requests.get(f"{self.base_url}/check_embeddings/")
-        if response.status_code == 200:
-            return response.json()
-        else:
-            raise Exception(f"Failed to check embeddings: {response.text}")
-
-    def enhanced_retrieve(self, query, api_key):
-        """Retrieve enhanced prompt and related documents using RAG pipeline."""
-        response = requests.post(
-            f"{self.base_url}/enhanced_retrieve/",
-            json={"query": query, "api_key": api_key}
+        return self._get("/check_embeddings/", "check embeddings")
+
+    def enhanced_retrieve(self, query, api_key, bypass_cache=False, filters=None):
+        """Retrieve enhanced prompt and related documents using RAG pipeline.
+
+        `filters` restricts retrieval to matching metadata, e.g. {"category": "faqs"}.
+        """
+        return self._post(
+            "/enhanced_retrieve/",
+            "perform enhanced retrieval",
+            {"query": query, "api_key": api_key, "bypass_cache": bypass_cache, "filters": filters}
+        )
+
+    def enhanced_retrieve_stream(self, query, api_key, bypass_cache=False, filters=None):
+        """Stream the RAG pipeline, yielding events as the service sends them.
+
+        The first event is `context` (enhanced prompt and documents used), then one
+        `token` event per LLM chunk and a final `done` event with the full response.
+        """
+        action = "perform streaming enhanced retrieval"
+        with self.session.post(
+            f"{self.base_url}/enhanced_retrieve_stream/",
+            json={"query": query, "api_key": api_key, "bypass_cache": bypass_cache, "filters": filters},
+            timeout=self.timeout,
+            stream=True
+        ) as response:
+            if response.status_code != 200:
+                raise Exception(f"Failed to {action}: {response.text}")
+            for line in response.iter_lines(decode_unicode=True):
+                if line:
+                    yield _stream_event(line, action)
+
+    def enhanced_retrieve_batch(self, queries, api_key, max_concurrency=8):
+        """Run the RAG pipeline for many queries in one request; each result may carry an `error`."""
+        return self._post(
+            "/enhanced_retrieve_batch/",
+            "perform batch enhanced retrieval",
+            {"queries": list(queries), "api_key": api_key, "max_concurrency": max_concurrency}
+        )["results"]
+
+
+class AsyncRAGServiceClient:
+    def __init__(self, base_url=DEFAULT_BASE_URL, timeout=DEFAULT_TIMEOUT, retries=DEFAULT_RETRIES,
+                 max_connections=DEFAULT_POOL_SIZE):
+        """Async counterpart of `RAGServiceClient` on a shared `httpx.AsyncClient`.
+
+        Connection failures are retried by the transport; the pool is capped at
+        `max_connections` so large fan-outs queue instead of flooding the service.
+        """
+        connect_timeout, read_timeout = timeout
+        self.base_url = base_url
+        self.client = httpx.AsyncClient(
+            base_url=base_url,
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            transport=httpx.AsyncHTTPTransport(retries=retries)
+        )
+
+    async def aclose(self):
+        """Close the pooled connections."""
+        await self.client.aclose()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    async def _post(self, path, action, json=None, timeout=None):
+        response = await self.client.post(path, json=json, timeout=timeout or httpx.USE_CLIENT_DEFAULT)
+        return _json_or_raise(response, action)
+
+    async def _get(self, path, action):
+        response = await self.client.get(path)
+        return _json_or_raise(response, action)
+
+    async def get_embedding(self, text):
+        """Generate embedding for a given text."""
+        return (await self._post("/embed/", "get embedding", {"text": text}))["embedding"]
+
+    async def get_embeddings(self, texts):
+        """Generate embeddings for many texts in one request."""
+        return (await self._post("/embed_batch/", "get embeddings", {"texts": list(texts)}))["embeddings"]
+
+    async def store_embedding(self, text):
+        """Store the embedding of the given text in the RAG service."""
+        return await self._post("/store/", "store embedding", {"text": text})
+
+    async def retrieve_similar(self, query, k=5, **options):
+        """Retrieve items similar to the given query text, without an LLM call."""
+        result = await self._post("/retrieve/", "retrieve similar items", {"query": query, "k": k, **options})
+        return result["results"]
+
+    async def retrieve_similar_batch(self, queries, k=5, **options):
+        """Retrieve similar items for many queries in one request; returns one result list per query."""
+        result = await self._post(
+            "/retrieve_batch/",
+            "retrieve similar items",
+            {"queries": list(queries), "k": k, **options}
+        )
+        return result["results"]
+
+    async def embed_all_documents(self):
+        """Call the endpoint to embed all documents."""
+        connect_timeout, read_timeout = INGEST_TIMEOUT
+        return await self._post(
+            "/embed_all_documents/",
+            "embed all documents",
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout)
+        )
+
+    async def clear_embeddings(self):
+        """Call the endpoint to clear all embeddings."""
+        return await self._post("/clear_embeddings/", "clear embeddings")
+
+    async def check_embeddings(self):
+        """Call the endpoint to check the number of embeddings."""
+        return await self._get("/check_embeddings/", "check embeddings")
+
+    async def enhanced_retrieve(self, query, api_key, bypass_cache=False, filters=None):
+        """Retrieve enhanced prompt and related documents using RAG pipeline.
+
+        `filters` restricts retrieval to matching metadata, e.g. {"category": "faqs"}.
+        """
+        return await self._post(
+            "/enhanced_retrieve/",
+            "perform enhanced retrieval",
+            {"query": query, "api_key": api_key, "bypass_cache": bypass_cache, "filters": filters}
+        )
+
+    async def enhanced_retrieve_stream(self, query, api_key, bypass_cache=False, filters=None):
+        """Async `enhanced_retrieve_stream`: yields `context`, `token` and `done` events as they arrive."""
+        action = "perform streaming enhanced retrieval"
+        async with self.client.stream(
+            "POST",
+            "/enhanced_retrieve_stream/",
+            json={"query": query, "api_key": api_key, "bypass_cache": bypass_cache, "filters": filters}
+        ) as response:
+            if response.status_code != 200:
+                await response.aread()
+                raise Exception(f"Failed to {action}: {response.text}")
+            async for line in response.aiter_lines():
+                if line:
+                    yield _stream_event(line, action)
+
+    async def enhanced_retrieve_batch(self, queries, api_key, max_concurrency=8):
+        """Run the RAG pipeline for many queries in one request; each result may carry an `error`."""
+        result = await self._post(
+            "/enhanced_retrieve_batch/",
+            "perform batch enhanced retrieval",
+            {"queries": list(queries), "api_key": api_key, "max_concurrency": max_concurrency}
         )
-        if response.status_code == 200:
-            return response.json()
-        else:
-            raise Exception(f"Failed to perform enhanced retrieval: {response.text}")
-        
+        return result["results"]
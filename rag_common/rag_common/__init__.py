@@ -0,0 +1,3 @@
+# rag_common
+# Modules shared by the RAG service and the prompt tester: the SQLite generation
+# cache, the LLM backends and the stage timers behind /metrics
@@ -0,0 +1,143 @@
+# generation_cache.py
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+from langchain_core.caches import BaseCache
+from langchain_core.load import dumps, loads
+
+# Both applications default to the same database at the repository root (this package
+# is installed in editable mode from rag_common/) so the RAG pipeline and the prompt
+# tester share generations
+DEFAULT_CACHE_PATH = os.getenv(
+    "LLM_CACHE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "llm_cache.sqlite")
+)
+DEFAULT_TTL_SECONDS = float(os.getenv("LLM_CACHE_TTL_SECONDS", 7 * 24 * 3600))
+DEFAULT_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", 100_000))
+EVICT_EVERY = 500  # Inserts between TTL sweeps
+EVICT_TO = 0.9  # Fraction of max_entries kept after a size eviction, so the next one is not one insert away
+
+
+class GenerationCache(BaseCache):
+    """LangChain LLM cache persisted in SQLite, with TTL and size-based eviction.
+
+    Entries are keyed by a hash of the prompt and LangChain's `llm_string`, which
+    encodes the model name and sampling parameters. Expired entries are dropped on
+    lookup and swept every `EVICT_EVERY` inserts. Once the tracked entry count
+    exceeds `max_entries`, the least recently used entries are evicted.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, ttl_seconds=DEFAULT_TTL_SECONDS, max_entries=DEFAULT_MAX_ENTRIES):
+        self.path = os.path.abspath(path)
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")  # Readers in the other app don't block writers
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS generations (
+                key TEXT PRIMARY KEY,
+                llm_string TEXT NOT NULL,
+                response TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS generations_last_used ON generations (last_used)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS generations_created_at ON generations (created_at)")
+        self._conn.commit()
+        # Approximate: replaced keys and writes by the other app are reconciled at each eviction
+        self._entries = self._conn.execute("SELECT COUNT(*) FROM generations").fetchone()[0]
+        self._inserts_since_evict = 0
+
+    @staticmethod
+    def key(prompt, llm_string):
+        return hashlib.sha256(f"{llm_string}\0{prompt}".encode("utf-8")).hexdigest()
+
+    def lookup(self, prompt, llm_string):
+        key = self.key(prompt, llm_string)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, created_at FROM generations WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and self.ttl_seconds and now - row[1] > self.ttl_seconds:
+                self._conn.execute("DELETE FROM generations WHERE key = ?", (key,))
+                self._conn.commit()
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE generations SET last_used = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+        return loads(row[0])
+
+    def update(self, prompt, llm_string, return_val):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO generations (key, llm_string, response, created_at, last_used) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (self.key(prompt, llm_string), llm_string, dumps(return_val), now, now)
+            )
+            self._entries += 1
+            self._inserts_since_evict += 1
+            if self._entries > self.max_entries or self._inserts_since_evict >= EVICT_EVERY:
+                self._evict()
+            self._conn.commit()
+
+    def clear(self, **kwargs):
+        with self._lock:
+            self._conn.execute("DELETE FROM generations")
+            self._conn.commit()
+            self._entries = 0
+
+    def stats(self):
+        """Return hit/miss counters for this process and the number of stored generations."""
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM generations").fetchone()[0]
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "entries": entries,
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds
+            }
+
+    def _evict(self):
+        if self.ttl_seconds:
+            self._conn.execute("DELETE FROM generations WHERE created_at < ?", (time.time() - self.ttl_seconds,))
+        self._entries = self._conn.execute("SELECT COUNT(*) FROM generations").fetchone()[0]
+        self._inserts_since_evict = 0
+        if self._entries > self.max_entries:
+            overflow = self._entries - int(self.max_entries * EVICT_TO)
+            self._conn.execute(
+                "DELETE FROM generations WHERE key IN "
+                "(SELECT key FROM generations ORDER BY last_used ASC LIMIT ?)",
+                (overflow,)
+            )
+            self._entries -= overflow
+
+
+_shared_cache = None
+_shared_lock = threading.Lock()
+
+
+def get_generation_cache():
+    """Return the process-wide generation cache, opening it on first use."""
+    global _shared_cache
+    with _shared_lock:
+        if _shared_cache is None:
+            _shared_cache = GenerationCache()
+        return _shared_cache
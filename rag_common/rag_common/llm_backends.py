@@ -0,0 +1,161 @@
+# llm_backends.py
+import asyncio
+import hashlib
+import os
+import random
+import re
+import time
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional
+
+from langchain_core.caches import BaseCache
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.globals import get_llm_cache
+from langchain_core.language_models.llms import LLM
+from langchain_core.outputs import GenerationChunk
+
+# "openai" calls the OpenAI API, "local" an OpenAI-compatible server (llama.cpp,
+# vLLM, Ollama, ...) and "fake" answers in-process without any network access
+LLM_BACKENDS = ("openai", "local", "fake")
+DEFAULT_BACKEND = os.getenv("LLM_BACKEND", "openai")
+DEFAULT_LOCAL_BASE_URL = os.getenv("LOCAL_LLM_BASE_URL", "http://localhost:8080/v1")
+DEFAULT_LOCAL_MODEL = os.getenv("LOCAL_LLM_MODEL", "local-model")
+
+# Fake backend defaults
+DEFAULT_FAKE_LATENCY_MS = float(os.getenv("FAKE_LLM_LATENCY_MS", 0))  # Delay before the first token
+DEFAULT_FAKE_TOKEN_LATENCY_MS = float(os.getenv("FAKE_LLM_TOKEN_LATENCY_MS", 0))  # Delay per generated token
+DEFAULT_FAKE_JITTER_MS = float(os.getenv("FAKE_LLM_JITTER_MS", 0))  # Extra first-token delay, up to this much
+DEFAULT_FAKE_RESPONSE_SENTENCES = 3
+
+
+class DeterministicFakeLLM(LLM):
+    """Offline stand-in for the OpenAI LLM.
+
+    The response is a few sentences drawn from the prompt itself, chosen by a
+    seed derived from the prompt, so the same prompt always gets the same answer
+    and the metric code sees realistic text. Latency is injected before the first
+    token and between tokens; the async methods sleep without blocking the event
+    loop, so concurrency behaves like a remote model.
+    """
+
+    latency_ms: float = DEFAULT_FAKE_LATENCY_MS
+    token_latency_ms: float = DEFAULT_FAKE_TOKEN_LATENCY_MS
+    jitter_ms: float = DEFAULT_FAKE_JITTER_MS
+    response_sentences: int = DEFAULT_FAKE_RESPONSE_SENTENCES
+
+    @property
+    def _llm_type(self) -> str:
+        return "deterministic-fake"
+
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        return {"response_sentences": self.response_sentences}
+
+    def respond(self, prompt: str) -> str:
+        """Return the deterministic response for `prompt`, without any delay."""
+        rng = self._rng(prompt)
+        sentences = [s for s in re.split(r"(?<=[.!?])\s+", " ".join(prompt.split())) if s]
+        if len(sentences) <= self.response_sentences:
+            return " ".join(sentences)
+        picked = sorted(rng.sample(range(len(sentences)), self.response_sentences))
+        return " ".join(sentences[i] for i in picked)
+
+    def get_num_tokens(self, text: str) -> int:
+        # Words and punctuation, close enough to BPE counts without downloading a tokenizer
+        return len(re.findall(r"\w+|[^\w\s]", text))
+
+    def _call(self, prompt: str, stop: Optional[List[str]] = None,
+              run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> str:
+        response = self.respond(prompt)
+        time.sleep(self._first_token_delay(prompt) + self._token_delay() * len(self._tokens(response)))
+        return response
+
+    async def _acall(self, prompt: str, stop: Optional[List[str]] = None,
+                     run_manager: Optional[AsyncCallbackManagerForLLMRun] = None, **kwargs: Any) -> str:
+        response = self.respond(prompt)
+        await asyncio.sleep(self._first_token_delay(prompt) + self._token_delay() * len(self._tokens(response)))
+        return response
+
+    def _stream(self, prompt: str, stop: Optional[List[str]] = None,
+                run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> Iterator[GenerationChunk]:
+        time.sleep(self._first_token_delay(prompt))
+        for i, token in enumerate(self._tokens(self.respond(prompt))):
+            if i:
+                time.sleep(self._token_delay())
+            chunk = GenerationChunk(text=token)
+            if run_manager:
+                run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+
+    async def _astream(self, prompt: str, stop: Optional[List[str]] = None,
+                       run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+                       **kwargs: Any) -> AsyncIterator[GenerationChunk]:
+        await asyncio.sleep(self._first_token_delay(prompt))
+        for i, token in enumerate(self._tokens(self.respond(prompt))):
+            if i:
+                await asyncio.sleep(self._token_delay())
+            chunk = GenerationChunk(text=token)
+            if run_manager:
+                await run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+
+    @staticmethod
+    def _rng(prompt):
+        return random.Random(hashlib.sha256(prompt.encode("utf-8")).digest())
+
+    @staticmethod
+    def _tokens(text):
+        return re.findall(r"\S+\s*", text)
+
+    def _first_token_delay(self, prompt):
+        jitter = self._rng(prompt).uniform(0, self.jitter_ms) if self.jitter_ms else 0.0
+        return (self.latency_ms + jitter) / 1000
+
+    def _token_delay(self):
+        return self.token_latency_ms / 1000
+
+
+def create_llm(api_key: Optional[str] = None, backend: str = DEFAULT_BACKEND, cache=None, **kwargs) -> LLM:
+    """Build the LLM for `backend`.
+
+    Args:
+        api_key (str): OpenAI key; unused by the fake backend and optional for local servers.
+        backend (str): One of `LLM_BACKENDS`, defaulting to the `LLM_BACKEND` environment variable.
+        cache: LangChain cache for generations, or False to disable caching.
+        **kwargs: Extra fields for the model class, e.g. `latency_ms` for the fake backend.
+    """
+    if backend not in LLM_BACKENDS:
+        raise ValueError(f"Unknown LLM backend '{backend}', expected one of {LLM_BACKENDS}")
+    if backend == "fake":
+        return DeterministicFakeLLM(cache=cache, **kwargs)
+
+    from langchain_community.llms import OpenAI
+    if backend == "local":
+        return OpenAI(
+            api_key=api_key or "not-needed",
+            openai_api_base=DEFAULT_LOCAL_BASE_URL,
+            model_name=DEFAULT_LOCAL_MODEL,
+            cache=cache,
+            **kwargs
+        )
+    return OpenAI(api_key=api_key, cache=cache, **kwargs)
+
+
+def generation_cache_for(llm, stop=None):
+    """Return the `(cache, llm_string)` that `llm.generate` would use, or `(None, None)` if caching is off.
+
+    `astream` never reads or writes the LLM cache, so streaming callers look it up
+    themselves with these to share entries with non-streamed calls.
+    """
+    cache = llm.cache
+    if cache is None or cache is True:
+        cache = get_llm_cache()
+    if not isinstance(cache, BaseCache):
+        return None, None
+    params = llm.dict()
+    params["stop"] = stop
+    return cache, str(sorted(params.items()))
+
+
+def split_tokens(text):
+    """Split a cached response into word-sized chunks for replaying it as a stream."""
+    return re.findall(r"\s*\S+\s*|\s+", text) if text else []
@@ -0,0 +1,153 @@
+# stage_timing.py
+import threading
+import time
+from contextlib import contextmanager
+
+# Histogram bucket upper bounds in seconds, from a cache hit to a slow LLM call
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _label_string(labels):
+    return ",".join(f'{name}="{str(value)}"' for name, value in labels)
+
+
+class Histogram:
+    """Prometheus-style cumulative histogram, one series per label set."""
+
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # labels -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[len(self.buckets)] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                labels = _label_string(key)
+                prefix = f"{labels}," if labels else ""
+                for bound, count in zip(self.buckets, series):
+                    lines.append(f'{self.name}_bucket{{{prefix}le="{bound}"}} {count}')
+                lines.append(f'{self.name}_bucket{{{prefix}le="+Inf"}} {series[len(self.buckets)]}')
+                lines.append(f"{self.name}_sum{{{labels}}} {series[-1]}")
+                lines.append(f"{self.name}_count{{{labels}}} {series[len(self.buckets)]}")
+        return lines
+
+
+class MetricsRegistry:
+    """Histograms observed in-process plus gauges and counters read from callbacks at scrape time."""
+
+    def __init__(self):
+        self._histograms = {}
+        self._callbacks = {}
+        self._lock = threading.Lock()
+
+    def histogram(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        with self._lock:
+            if name not in self._histograms:
+                self._histograms[name] = Histogram(name, help_text, buckets)
+            return self._histograms[name]
+
+    def gauge(self, name, help_text, read_fn):
+        """Register `read_fn`, returning a number or a `{labels dict as tuple: value}` mapping."""
+        with self._lock:
+            self._callbacks[name] = (help_text, read_fn, "gauge")
+
+    def counter(self, name, help_text, read_fn):
+        """Like `gauge`, for a value that only ever increases; `name` should end in `_total`."""
+        with self._lock:
+            self._callbacks[name] = (help_text, read_fn, "counter")
+
+    def render(self):
+        """Return every metric in the Prometheus text exposition format."""
+        with self._lock:
+            histograms = list(self._histograms.values())
+            callbacks = list(self._callbacks.items())
+
+        lines = []
+        for histogram in histograms:
+            lines.extend(histogram.render())
+        for name, (help_text, read_fn, metric_type) in callbacks:
+            try:
+                value = read_fn()
+            except Exception:
+                continue
+            lines.extend([f"# HELP {name} {help_text}", f"# TYPE {name} {metric_type}"])
+            if isinstance(value, dict):
+                for labels, series_value in value.items():
+                    lines.append(f"{name}{{{_label_string(labels)}}} {series_value}")
+            else:
+                lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+STAGE_SECONDS = registry.histogram("rag_stage_seconds", "Time spent in each pipeline stage.")
+
+
+class StageTimer:
+    """Per-request stage timings, also observed into the process-wide stage histogram.
+
+    Durations of a stage entered several times (e.g. per batch) are summed.
+    """
+
+    def __init__(self, pipeline, histogram=STAGE_SECONDS):
+        self.pipeline = pipeline
+        self.histogram = histogram
+        self.timings = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started)
+
+    def record(self, name, seconds):
+        with self._lock:
+            self.timings[name] = self.timings.get(name, 0.0) + seconds
+        self.histogram.observe(seconds, pipeline=self.pipeline, stage=name)
+
+    def iterate(self, name, iterable, every=1):
+        """Yield from `iterable`, timing how long each item takes to arrive.
+
+        The waits are summed and recorded once per `every` items, so a long stream
+        adds one histogram observation per batch rather than one per item.
+        """
+        iterator = iter(iterable)
+        waited = 0.0
+        count = 0
+        while True:
+            started = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.record(name, waited + time.perf_counter() - started)
+                return
+            waited += time.perf_counter() - started
+            count += 1
+            if count >= every:
+                self.record(name, waited)
+                waited = 0.0
+                count = 0
+            yield item
+
+    def as_ms(self):
+        """Stage timings in milliseconds, for response payloads and logs."""
+        with self._lock:
+            return {name: round(seconds * 1000, 3) for name, seconds in self.timings.items()}
@@ -0,0 +1,28 @@
+# async_db.py
+import asyncio
+import logging
+from datetime import timedelta
+import lancedb
+from db_config import db_uri
+
+_connection = None
+_collection = None
+_lock = asyncio.Lock()
+
+
+async def get_async_collection():
+    """Open the "embeddings" table through LanceDB's async API, once per process.
+
+    The connection re-checks the table version on every read so rows written
+    through the synchronous `db_config.collection` (ingestion, admin endpoints)
+    are visible immediately.
+    """
+    global _connection, _collection
+    if _collection is not None:
+        return _collection
+    async with _lock:
+        if _collection is None:
+            _connection = await lancedb.connect_async(db_uri, read_consistency_interval=timedelta(0))
+            _collection = await _connection.open_table("embeddings")
+            logging.info("Opened async table 'embeddings'")
+    return _collection
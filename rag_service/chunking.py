@@ -0,0 +1,165 @@
+# chunking.py
+import re
+
+# Chunking defaults (sizes are in whitespace-delimited tokens)
+DEFAULT_CHUNK_STRATEGY = "sentence"
+DEFAULT_CHUNK_SIZE = 128
+DEFAULT_CHUNK_OVERLAP = 32
+
+CHUNK_STRATEGIES = ("fixed", "sentence", "section")
+
+_TOKEN_PATTERN = re.compile(r"\S+")
+# A sentence ends at punctuation followed by whitespace, so "$300.00" or "v2.1" stay whole
+_SENTENCE_PATTERN = re.compile(r"[^\n]+?(?:[.!?]+(?=\s|$)|\n|$)")
+_SECTION_SEPARATOR = re.compile(r"\n\s*\n")
+
+
+def _token_count(text):
+    return len(_TOKEN_PATTERN.findall(text))
+
+
+def _make_chunk(text, chunk_index, start, end):
+    return {
+        "text": text[start:end],
+        "chunk_index": chunk_index,
+        "start_offset": start,
+        "end_offset": end
+    }
+
+
+def _fixed_spans(text, chunk_size, overlap):
+    """Split into windows of `chunk_size` tokens, each sharing `overlap` tokens with the previous one."""
+    tokens = [match.span() for match in _TOKEN_PATTERN.finditer(text)]
+    step = max(1, chunk_size - overlap)
+    spans = []
+    for i in range(0, len(tokens), step):
+        window = tokens[i:i + chunk_size]
+        spans.append((window[0][0], window[-1][1]))
+        if i + chunk_size >= len(tokens):
+            break
+    return spans
+
+
+def _sentence_spans(text):
+    spans = []
+    for match in _SENTENCE_PATTERN.finditer(text):
+        start, end = match.span()
+        # Trim surrounding whitespace so offsets point at the sentence itself
+        while start < end and text[start].isspace():
+            start += 1
+        while end > start and text[end - 1].isspace():
+            end -= 1
+        if start < end:
+            spans.append((start, end))
+    return spans
+
+
+def _section_spans(text, chunk_size):
+    """Split on blank lines; sections that are too long fall back to sentence spans."""
+    spans = []
+    position = 0
+    for separator in list(_SECTION_SEPARATOR.finditer(text)) + [None]:
+        end = separator.start() if separator else len(text)
+        section = text[position:end]
+        if section.strip():
+            if _token_count(section) > chunk_size:
+                spans.extend((position + s, position + e) for s, e in _sentence_spans(section))
+            else:
+                offset = len(section) - len(section.lstrip())
+                spans.append((position + offset, position + len(section.rstrip())))
+        position = separator.end() if separator else len(text)
+    return spans
+
+
+def _pack_spans(text, spans, chunk_size, overlap):
+    """Greedily pack consecutive spans into chunks of at most `chunk_size` tokens.
+
+    Each new chunk starts with the trailing spans of the previous chunk that fit
+    in `overlap` tokens. Spans longer than `chunk_size` are split with fixed windows.
+    """
+    units = []
+    for start, end in spans:
+        if _token_count(text[start:end]) > chunk_size:
+            units.extend((start + s, start + e) for s, e in _fixed_spans(text[start:end], chunk_size, overlap))
+        else:
+            units.append((start, end))
+
+    counts = [_token_count(text[start:end]) for start, end in units]
+    packed = []
+    i = 0
+    while i < len(units):
+        j = i
+        total = 0
+        while j < len(units) and (j == i or total + counts[j] <= chunk_size):
+            total += counts[j]
+            j += 1
+        packed.append((units[i][0], units[j - 1][1]))
+        if j >= len(units):
+            break
+
+        # Step back over trailing units that fit in the overlap budget
+        next_start = j
+        carried = 0
+        while next_start - 1 > i and carried + counts[next_start - 1] <= overlap:
+            next_start -= 1
+            carried += counts[next_start]
+        i = next_start
+    return packed
+
+
+def chunk_text(text, strategy=DEFAULT_CHUNK_STRATEGY, chunk_size=DEFAULT_CHUNK_SIZE, overlap=DEFAULT_CHUNK_OVERLAP):
+    """Split `text` into overlapping chunks.
+
+    Args:
+        text (str): The document content.
+        strategy (str): "fixed" (token windows), "sentence" (pack whole sentences)
+            or "section" (pack blank-line separated sections).
+        chunk_size (int): Maximum tokens per chunk.
+        overlap (int): Tokens shared between consecutive chunks.
+
+    Returns:
+        List[Dict]: Chunks with `text`, `chunk_index`, `start_offset` and `end_offset`
+        (character offsets into `text`).
+    """
+    if strategy not in CHUNK_STRATEGIES:
+        raise ValueError(f"Unknown chunk strategy '{strategy}', expected one of {CHUNK_STRATEGIES}")
+    if chunk_size <= 0:
+        raise ValueError("chunk_size must be positive")
+    overlap = max(0, min(overlap, chunk_size - 1))
+
+    if not text.strip():
+        return []
+
+    if strategy == "fixed":
+        spans = _fixed_spans(text, chunk_size, overlap)
+    elif strategy == "sentence":
+        spans = _pack_spans(text, _sentence_spans(text), chunk_size, overlap)
+    else:
+        spans = _pack_spans(text, _section_spans(text, chunk_size), chunk_size, overlap)
+
+    return [_make_chunk(text, index, start, end) for index, (start, end) in enumerate(spans)]
+
+
+def chunk_id(doc_id, chunk_index):
+    """Build the `text_id` stored for a chunk."""
+    return f"{doc_id}#{chunk_index}"
+
+
+def chunk_document(doc_id, text_content, strategy=DEFAULT_CHUNK_STRATEGY, chunk_size=DEFAULT_CHUNK_SIZE,
+                   overlap=DEFAULT_CHUNK_OVERLAP, metadata=None):
+    """Split a document into chunk rows (without vectors) ready for encoding."""
+    metadata = metadata or {}
+    return [
+        {
+            "text_id": chunk_id(doc_id, chunk["chunk_index"]),
+            "original_text": chunk["text"],
+            "doc_id": doc_id,
+            "chunk_index": chunk["chunk_index"],
+            "start_offset": chunk["start_offset"],
+            "end_offset": chunk["end_offset"],
+            "category": metadata.get("category"),
+            "source_file": metadata.get("source_file"),
+            "doc_date": metadata.get("doc_date")
+        }
+        for chunk in chunk_text(text_content, strategy, chunk_size, overlap)
+    ]
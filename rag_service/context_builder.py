@@ -0,0 +1,86 @@
+# context_builder.py
+import numpy as np
+
+# Context assembly defaults
+DEFAULT_TOKEN_BUDGET = 1500  # Tokens of retrieved context allowed in the prompt
+DEFAULT_DEDUP_THRESHOLD = 0.95  # Cosine similarity above which two passages count as duplicates
+SEPARATOR_TOKENS = 2  # Cost of the blank line between passages
+
+
+def _unit(vector):
+    vector = np.asarray(vector, dtype=np.float32)
+    return vector / max(float(np.linalg.norm(vector)), 1e-12)
+
+
+def _normalized_text(text):
+    return " ".join(text.split()).lower()
+
+
+def mmr_order(docs, query_embedding, mmr_lambda):
+    """Order passages by maximal marginal relevance.
+
+    Each step picks the passage maximizing
+    `mmr_lambda * sim(query, p) - (1 - mmr_lambda) * max sim(p, already picked)`,
+    trading relevance for diversity.
+    """
+    vectors = np.stack([_unit(doc["vector"]) for doc in docs])
+    relevance = vectors @ _unit(query_embedding)
+    similarity = vectors @ vectors.T
+
+    remaining = list(range(len(docs)))
+    picked = []
+    while remaining:
+        if picked:
+            redundancy = similarity[np.ix_(remaining, picked)].max(axis=1)
+        else:
+            redundancy = np.zeros(len(remaining))
+        scores = mmr_lambda * relevance[remaining] - (1 - mmr_lambda) * redundancy
+        picked.append(remaining.pop(int(np.argmax(scores))))
+    return [docs[i] for i in picked]
+
+
+def select_passages(docs, count_tokens, token_budget=DEFAULT_TOKEN_BUDGET, dedup_threshold=DEFAULT_DEDUP_THRESHOLD,
+                    query_embedding=None, mmr_lambda=None):
+    """Pick the passages that go into the prompt.
+
+    Passages are taken best first (or in MMR order when `mmr_lambda` is set)
+    and skipped if they repeat an already chosen passage, either verbatim or
+    with a vector similarity of at least `dedup_threshold`. Passages that
+    would overflow `token_budget` are skipped so smaller ones can still fit.
+
+    Args:
+        docs (List[Dict]): Retrieved rows with `original_text` and, for dedup/MMR, `vector`.
+        count_tokens (Callable[[str], int]): Tokenizer of the LLM the prompt is sent to.
+
+    Returns:
+        List[Dict]: The chosen rows, in prompt order.
+    """
+    has_vectors = bool(docs) and all(doc.get("vector") is not None for doc in docs)
+    if mmr_lambda is not None and query_embedding is not None and has_vectors:
+        docs = mmr_order(docs, query_embedding, mmr_lambda)
+
+    selected = []
+    selected_vectors = []
+    seen_texts = set()
+    used_tokens = 0
+    for doc in docs:
+        text = doc["original_text"]
+        text_key = _normalized_text(text)
+        if text_key in seen_texts:
+            continue
+
+        vector = _unit(doc["vector"]) if has_vectors else None
+        if vector is not None and selected_vectors:
+            if max(float(vector @ other) for other in selected_vectors) >= dedup_threshold:
+                continue
+
+        tokens = count_tokens(text) + SEPARATOR_TOKENS
+        if used_tokens + tokens > token_budget:
+            continue
+
+        selected.append(doc)
+        seen_texts.add(text_key)
+        if vector is not None:
+            selected_vectors.append(vector)
+        used_tokens += tokens
+    return selected
@@ -1,11 +1,15 @@
 # db_config.py
+import os
+from datetime import timedelta
 import lancedb
 import logging
-from sentence_transformers import SentenceTransformer
 import pyarrow as pa
-
-# Initialize logging
-logging.basicConfig(level=logging.INFO)
+from embedding_cache import EmbeddingCache
+from filters import FILTER_COLUMNS
+from index_manager import IndexManager
+from micro_batcher import DEFAULT_MAX_BATCH_SIZE, DEFAULT_MAX_WAIT_MS
+from model_registry import DEFAULT_MODEL_NAME, DEFAULT_BACKEND
+from semantic_cache import SemanticQueryCache, DEFAULT_MAX_DISTANCE
 
 # **TODO 1**: Initialize the `SentenceTransformer` model, connect to LanceDB, define the embedding dimensions, and set up the schema for storing embeddings.
 # ```plaintext
@@ -19,20 +23,48 @@ logging.basicConfig(level=logging.INFO)
 #    - Add `original_text` as a string field to store the raw document content.
 # ```
 
-# Initialize the SentenceTransformer model
-model = SentenceTransformer('all-MiniLM-L6-v2')
+# The SentenceTransformer model is loaded lazily, once per process, by model_registry
+model_name = DEFAULT_MODEL_NAME
+# Inference backend (torch, torch_int8, onnx or onnx_int8), set with EMBED_BACKEND
+embedding_backend = DEFAULT_BACKEND
 
 # Connect to LanceDB
-db = lancedb.connect("lance_db")
+db_uri = "lance_db"
+# Re-check the table version on every read, like async_db, so rows written through the
+# async handle (e.g. /store/) are visible to deletes, counts and index maintenance here
+db = lancedb.connect(db_uri, read_consistency_interval=timedelta(0))
+
+# Manifest of ingested files (mtime, size, content hash) used for incremental syncs
+manifest_path = os.path.join(db_uri, "ingest_manifest.json")
 
 # Define the embedding dimensions
 embedding_dim = 384
 
+# Shared cache so texts that were already embedded never pay inference cost again
+embedding_cache = EmbeddingCache(
+    model_name,
+    db,
+    embedding_dim,
+    max_batch_size=int(os.getenv("EMBED_MAX_BATCH_SIZE", DEFAULT_MAX_BATCH_SIZE)),
+    max_wait_ms=float(os.getenv("EMBED_MAX_WAIT_MS", DEFAULT_MAX_WAIT_MS)),
+    backend=embedding_backend
+)
+
+# Search results reused for near-duplicate queries; invalidated on every table write
+semantic_cache = SemanticQueryCache(max_distance=float(os.getenv("SEMANTIC_CACHE_MAX_DISTANCE", DEFAULT_MAX_DISTANCE)))
+
 # Define the schema for the embeddings table
 schema = pa.schema([
     pa.field("text_id", pa.string()),
     pa.field("vector", pa.list_(pa.float32(), embedding_dim)),
-    pa.field("original_text", pa.string())
+    pa.field("original_text", pa.string()),
+    pa.field("doc_id", pa.string()),
+    pa.field("chunk_index", pa.int32()),
+    pa.field("start_offset", pa.int32()),
+    pa.field("end_offset", pa.int32()),
+    pa.field("category", pa.string()),
+    pa.field("source_file", pa.string()),
+    pa.field("doc_date", pa.string())
 ])
 
 # **TODO 2**: Initialize LanceDB by creating an embeddings table if it doesn’t exist, or opening the existing table. Configure the table to store `text_id`, `vector`, and `original_text` fields using the specified schema.
@@ -50,6 +82,9 @@ schema = pa.schema([
 #     - Open the existing "embeddings" table for use.
 # ```
 
+# SQL types of the columns that later versions added, used to migrate older tables
+MIGRATION_SQL_TYPES = {pa.string(): "string", pa.int32(): "int"}
+
 # Check if the "embeddings" table exists in LanceDB
 if "embeddings" not in db:
     # Create a new table named "embeddings" with the specified schema
@@ -64,28 +99,33 @@ else:
     collection = db["embeddings"]
     logging.info("Opened table 'embeddings'")
 
-# Create an index for vector search (only if table is not empty)
-try:
-    # **TODO 3**: Create an index on the `vector` field to enhance the speed of vector-based searches, which are crucial for efficiently retrieving similar documents. Perform this step only if the table contains data, ensuring optimized retrieval for LangChain’s pipeline.
-    # ```plaintext
-    # pseudocode:
-    # 1. Check if the "embeddings" table has any data by measuring its length:
-    #     - If the table contains data:
-    #         a. Create an index on the `vector` field, which stores document embeddings, to speed up similarity searches.
-    #         b. Use the "IVF_FLAT" index type and specify 10 partitions for effective query performance.
-    #     - If the table is empty:
-    #         a. Log a message indicating that index creation is skipped because there is no data.
-    # 2. Handle any exceptions during index creation, and if an error occurs, log a warning message with details about the issue.
-    # ```
-    if len(collection) > 0:
-        # TODO: this isn't quite right
-        # Create an index on the `vector` field for efficient similarity searches
-        collection.create_index(
-            "vector",
-            index_type="IVF_FLAT",
-            num_partitions=10
-        )
-    else:
-        logging.info("Skipping index creation as the table is empty")
-except Exception as e:
-    logging.warning(f"Could not create index: {str(e)}")
+    # Tables written by older versions lack newer columns. Add them as nulls rather than
+    # recreating the table, since rows stored through /store/ cannot be re-ingested
+    missing_fields = [field for field in schema if field.name not in collection.schema.names]
+    if missing_fields:
+        unsupported = [field.name for field in missing_fields if field.type not in MIGRATION_SQL_TYPES]
+        if unsupported:
+            raise RuntimeError(
+                f"Table 'embeddings' in '{db_uri}' is missing columns {unsupported} that cannot be added "
+                "automatically; migrate or clear the table before starting the service"
+            )
+        collection.add_columns({
+            field.name: f"CAST(NULL AS {MIGRATION_SQL_TYPES[field.type]})" for field in missing_fields
+        })
+        logging.warning(f"Added columns {[field.name for field in missing_fields]} to table 'embeddings' as nulls")
+
+        # Forget the ingested files so the next sync re-embeds them and fills in the new columns
+        if os.path.exists(manifest_path):
+            os.remove(manifest_path)
+
+# Keep the vector index sized to the table. The index type and partition counts are
+# chosen from the row count, and ingestion calls `index_manager.maybe_rebuild()` again
+# so tables populated after startup get indexed too
+index_manager = IndexManager(
+    collection,
+    embedding_dim,
+    os.path.join(db_uri, "index_state.json"),
+    scalar_columns=FILTER_COLUMNS
+)
+if index_manager.maybe_rebuild() == "unchanged" and len(collection) == 0:
+    logging.info("Skipping index creation as the table is empty")
@@ -1,89 +1,579 @@
-# embed_documents.py
-import os
-import json
-import requests
-from sentence_transformers import SentenceTransformer
-import logging
-from db_config import collection, model
-
-
-# Ensure logging is set up
-logging.basicConfig(level=logging.INFO)
-
-# Directory containing the HR documents
-base_dir = "../generated_hr_docs"
-
-# API endpoint for storing embeddings
-store_endpoint = "http://127.0.0.1:8000/store/"
-
-def embed_and_store_document(text, text_id):
-    # Generate the embedding vector
-    embedding_vector = model.encode(text).tolist()
-    
-    # Format the data for storing
-    store_data = {
-        "text_id": text_id,
-        "vector": embedding_vector,
-        "original_text": text
-    }
-    
-    # Send the data to the /store/ endpoint
-    response = requests.post(store_endpoint, json=store_data)
-    
-    if response.status_code == 200:
-        print(f"Document {text_id} stored successfully.")
-    else:
-        print(f"Error storing document {text_id}: {response.text}")
-
-
-def process_documents():
-
-    try:
-        for subdir, _, files in os.walk(base_dir):
-            for file in files:
-                if file.endswith(".json"):
-                    file_path = os.path.join(subdir, file)
-                    
-                    # Read the JSON document
-                    with open(file_path, "r", encoding="utf-8") as f:
-                        document = json.load(f)
-                        text_content = document.get("content", "")
-                        text_id = os.path.splitext(file)[0]
-                        
-                        if not text_content:
-                            logging.warning(f"No 'content' found in {file_path}")
-                            continue
-                        
-                        # Generate embedding
-                        embedding = model.encode(text_content).tolist()
-                        logging.info(f"Embedding generated for {file_path} with length {len(embedding)}")
-
-                        # Store embedding in LanceDB with error handling
-                        data = {
-                            "text_id": text_id,
-                            "vector": embedding,
-                            "original_text": text_content[:200]  # Store a snippet of the content
-                        }
-                        
-                        try:
-                            collection.add([data])
-                            logging.info(f"Document {file_path} stored successfully in LanceDB.")
-                            
-                            # Check the number of rows in LanceDB after adding
-                            current_count = collection.count_rows()
-                            logging.info(f"Current number of embeddings in collection after adding: {current_count}")
-
-                        except Exception as e:
-                            logging.error(f"Error adding data to collection: {str(e)}")
-                            continue
-
-        logging.info("All documents processed successfully.")
-
-    except Exception as e:
-        logging.error(f"Error processing documents: {str(e)}")
-
-
-
-# Run the process
-if __name__ == "__main__":
-    process_documents()
+# embed_documents.py
+import os
+import json
+import time
+import hashlib
+import re
+import requests
+import logging
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from functools import partial
+from itertools import islice
+import pyarrow as pa
+from db_config import collection, schema, manifest_path, embedding_cache, index_manager, semantic_cache
+from filters import sql_in
+from chunking import chunk_document, DEFAULT_CHUNK_STRATEGY, DEFAULT_CHUNK_SIZE, DEFAULT_CHUNK_OVERLAP
+from rag_common.stage_timing import StageTimer
+import ingest_worker
+
+
+# Directory containing the HR documents
+base_dir = "../generated_hr_docs"
+
+# API endpoint for storing embeddings
+store_endpoint = "http://127.0.0.1:8000/store/"
+
+# Document categories, matched against file name prefixes
+CATEGORY_PREFIXES = ("benefits", "faqs", "expense", "internal_memos", "job_descriptions", "employee_handbook")
+DATE_PATTERN = re.compile(r"\d{4}-\d{2}-\d{2}")
+
+# Bulk ingestion defaults
+DEFAULT_WRITE_BATCH_SIZE = 1024  # Rows per LanceDB write (one fragment per write)
+DEFAULT_ENCODE_BATCH_SIZE = 64  # Texts per SentenceTransformer forward pass
+DEFAULT_NUM_WORKERS = min(8, (os.cpu_count() or 1) + 4)  # Threads for reading/parsing files
+
+# Multi-process ingestion defaults
+DEFAULT_NUM_PROCESSES = int(os.getenv("INGEST_PROCESSES", 1))  # Embedding processes, each with its own model
+DEFAULT_DOCS_PER_TASK = 256  # Documents chunked and encoded per worker task
+DEFAULT_CHECKPOINT_SECONDS = 30  # How often the manifest is saved during a job
+PROGRESS_LOG_SECONDS = 10
+
+# Progress of the current or last multi-process job, see get_ingest_progress
+ingest_progress = {}
+_last_progress_log = 0.0
+
+def embed_and_store_document(text, text_id):
+    # Generate the embedding vector
+    embedding_vector = embedding_cache.encode(text).tolist()
+    
+    # Format the data for storing
+    store_data = {
+        "text_id": text_id,
+        "vector": embedding_vector,
+        "original_text": text
+    }
+    
+    # Send the data to the /store/ endpoint
+    response = requests.post(store_endpoint, json=store_data)
+    
+    if response.status_code == 200:
+        logging.debug(f"Document {text_id} stored successfully.")
+    else:
+        logging.error(f"Error storing document {text_id}: {response.text}")
+
+
+def iter_document_paths(directory=base_dir):
+    """Lazily yield the path of every JSON document under `directory`."""
+    for subdir, _, files in os.walk(directory):
+        for file in files:
+            if file.endswith(".json"):
+                yield os.path.join(subdir, file)
+
+
+def document_metadata(file_path, document, root=base_dir):
+    """Derive the category, source file and date columns stored with every chunk of a document.
+
+    `source_file` is relative to `root`, the directory being ingested.
+    """
+    file_name = os.path.basename(file_path)
+    category = next((prefix for prefix in CATEGORY_PREFIXES if file_name.startswith(prefix)), "other")
+
+    doc_date = document.get("date")
+    if not doc_date:
+        match = DATE_PATTERN.search(file_name)
+        doc_date = match.group(0) if match else None
+
+    return {
+        "category": category,
+        "source_file": os.path.relpath(file_path, root),
+        "doc_date": doc_date
+    }
+
+
+def load_document(file_path, root=base_dir):
+    """Read a JSON document and return `(text_id, text_content, metadata)`, or None if it has no content."""
+    try:
+        with open(file_path, "r", encoding="utf-8") as f:
+            document = json.load(f)
+    except Exception as e:
+        logging.error(f"Error reading {file_path}: {str(e)}")
+        return None
+
+    text_content = document.get("content", "")
+    if not text_content:
+        logging.warning(f"No 'content' found in {file_path}")
+        return None
+
+    text_id = os.path.splitext(os.path.basename(file_path))[0]
+    return text_id, text_content, document_metadata(file_path, document, root)
+
+
+def iter_loaded_documents(paths, num_workers=DEFAULT_NUM_WORKERS, read_ahead=DEFAULT_WRITE_BATCH_SIZE, root=base_dir,
+                          stats=None):
+    """Read and parse documents under `root` in a worker pool, `read_ahead` files at a time.
+
+    Unreadable or empty files are skipped and counted in `stats["unreadable"]` if `stats` is given.
+    """
+    paths = iter(paths)
+    load = partial(load_document, root=root)
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        while True:
+            window = list(islice(paths, read_ahead))
+            if not window:
+                break
+            for loaded in executor.map(load, window):
+                if loaded is not None:
+                    yield loaded
+                elif stats is not None:
+                    stats["unreadable"] = stats.get("unreadable", 0) + 1
+
+
+def build_record_batch(rows, encode_batch_size=DEFAULT_ENCODE_BATCH_SIZE, timer=None):
+    """Encode a list of chunk rows in one call and return an Arrow record batch."""
+    timer = timer or StageTimer("ingest")
+    with timer.stage("encode"):
+        embeddings = embedding_cache.encode([row["original_text"] for row in rows], batch_size=encode_batch_size)
+
+    with timer.stage("arrow"):
+        columns = {name: [row[name] for row in rows] for name in schema.names if name != "vector"}
+        columns["vector"] = [embedding.tolist() for embedding in embeddings]
+        return pa.RecordBatch.from_pydict(columns, schema=schema)
+
+
+def compact_collection():
+    """Merge the fragments written during ingestion so later searches scan fewer files."""
+    try:
+        if hasattr(collection, "optimize"):
+            collection.optimize()
+        else:
+            collection.compact_files()
+        logging.info("Compacted table 'embeddings'")
+    except Exception as e:
+        logging.warning(f"Could not compact table: {str(e)}")
+
+
+def load_manifest():
+    """Load the ingestion manifest, or an empty one if none has been written yet."""
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"documents": {}}
+    except Exception as e:
+        logging.warning(f"Could not read manifest {manifest_path}, starting fresh: {str(e)}")
+        return {"documents": {}}
+
+
+def save_manifest(manifest):
+    """Atomically write the ingestion manifest next to the LanceDB tables."""
+    os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, manifest_path)
+
+
+def reset_manifest():
+    """Forget every ingested document, e.g. after the table has been cleared."""
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+
+
+def content_hash(text_content, chunk_config, metadata=None):
+    """Hash the document content together with the chunking settings and metadata that produced its rows."""
+    digest = hashlib.sha256(chunk_config.encode("utf-8"))
+    digest.update(json.dumps(metadata or {}, sort_keys=True).encode("utf-8"))
+    digest.update(text_content.encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _candidate_paths(directory, entries, chunk_config, incremental, file_stats, stats):
+    """Yield the paths worth reading, recording `(mtime, size)` of every file found.
+
+    With `incremental=True` files whose mtime and size match the manifest are skipped
+    without being opened.
+    """
+    for file_path in iter_document_paths(directory):
+        doc_id = os.path.splitext(os.path.basename(file_path))[0]
+        file_stat = os.stat(file_path)
+        file_stats[doc_id] = (file_stat.st_mtime, file_stat.st_size)
+
+        entry = entries.get(doc_id)
+        if (
+            incremental
+            and entry is not None
+            and entry.get("config") == chunk_config
+            and (entry.get("mtime"), entry.get("size")) == file_stats[doc_id]
+        ):
+            stats["skipped"] += 1
+            continue
+        yield file_path
+
+
+def _manifest_entry(doc_id, text_content, metadata, entries, chunk_config, incremental, file_stats, stats):
+    """Return the manifest entry a document will get once written, or None if it is unchanged."""
+    mtime, size = file_stats[doc_id]
+    digest = content_hash(text_content, chunk_config, metadata)
+
+    entry = entries.get(doc_id)
+    if incremental and entry is not None and entry.get("hash") == digest:
+        # Touched but unchanged, so only the recorded mtime needs refreshing
+        entry.update({"mtime": mtime, "size": size})
+        stats["skipped"] += 1
+        return None
+    return {"mtime": mtime, "size": size, "hash": digest, "config": chunk_config}
+
+
+def _finish_ingest(manifest, file_stats, stats, compact, timer):
+    """Delete rows of removed files, save the manifest, then compact and reindex if anything changed."""
+    entries = manifest["documents"]
+
+    # Delete rows for files that have disappeared since the last run
+    removed = [doc_id for doc_id in entries if doc_id not in file_stats]
+    if removed:
+        with timer.stage("delete"):
+            collection.delete(sql_in("doc_id", removed))
+        for doc_id in removed:
+            del entries[doc_id]
+        stats["removed"] = len(removed)
+        logging.info(f"Removed rows for {len(removed)} deleted documents.")
+
+    with timer.stage("manifest"):
+        save_manifest(manifest)
+
+    if compact and (stats["batches"] > 0 or removed):
+        with timer.stage("compact"):
+            compact_collection()
+
+    if stats["batches"] > 0 or removed:
+        semantic_cache.invalidate()
+        with timer.stage("index"):
+            stats["index"] = index_manager.maybe_rebuild(data_changed=True)
+
+    logging.info("All documents processed successfully.")
+
+
+def _report_stats(stats, start_time, timer):
+    elapsed = time.perf_counter() - start_time
+    stats["seconds"] = round(elapsed, 3)
+    stats["docs_per_sec"] = round(stats["documents"] / elapsed, 2) if elapsed > 0 else 0.0
+    stats["timings"] = timer.as_ms()
+    logging.info(
+        f"Ingested {stats['documents']} documents as {stats['chunks']} chunks in {stats['batches']} batches "
+        f"({stats['docs_per_sec']} docs/sec), skipped {stats['skipped']} unchanged, removed {stats['removed']}. "
+        f"Current number of embeddings in collection: {collection.count_rows()}"
+    )
+    return stats
+
+
+def process_documents(
+    directory=base_dir,
+    write_batch_size=DEFAULT_WRITE_BATCH_SIZE,
+    encode_batch_size=DEFAULT_ENCODE_BATCH_SIZE,
+    num_workers=DEFAULT_NUM_WORKERS,
+    compact=True,
+    chunk_strategy=DEFAULT_CHUNK_STRATEGY,
+    chunk_size=DEFAULT_CHUNK_SIZE,
+    chunk_overlap=DEFAULT_CHUNK_OVERLAP,
+    incremental=False,
+    num_processes=DEFAULT_NUM_PROCESSES
+):
+    """Stream every document under `directory` into LanceDB.
+
+    Files are read lazily by a worker pool and split into overlapping chunks.
+    Chunks are encoded `encode_batch_size` texts per forward pass and upserted
+    by `text_id` about `write_batch_size` rows at a time, so each write produces
+    one large fragment instead of one fragment per document, and re-running the
+    ingestion never duplicates rows.
+
+    A manifest of file mtimes and content hashes is kept next to the table. With
+    `incremental=True` only new or changed files are read and re-embedded. In both
+    modes rows of files that no longer exist are deleted.
+
+    With `num_processes` > 1 chunking and encoding run in a process pool, see
+    `process_documents_parallel`.
+
+    Returns:
+        Dict: Ingestion statistics (documents, chunks, skipped, removed, batches,
+        seconds, docs_per_sec) and per-stage `timings` in milliseconds.
+    """
+    if num_processes and num_processes > 1:
+        return process_documents_parallel(
+            directory, num_processes, write_batch_size, encode_batch_size, num_workers, compact,
+            chunk_strategy, chunk_size, chunk_overlap, incremental
+        )
+
+    start_time = time.perf_counter()
+    timer = StageTimer("ingest")
+    stats = {"documents": 0, "chunks": 0, "skipped": 0, "removed": 0, "batches": 0}
+
+    manifest = load_manifest()
+    entries = manifest.setdefault("documents", {})
+    chunk_config = f"{chunk_strategy}:{chunk_size}:{chunk_overlap}"
+    file_stats = {}
+
+    def flush(rows, batch_entries):
+        written = _write_batch(rows, encode_batch_size, timer)
+        if written == len(rows):
+            entries.update(batch_entries)
+            stats["chunks"] += written
+            stats["documents"] += len(batch_entries)
+        stats["batches"] += 1
+
+    try:
+        pending = []
+        pending_entries = {}
+        paths = _candidate_paths(directory, entries, chunk_config, incremental, file_stats, stats)
+        loaded = iter_loaded_documents(paths, num_workers, write_batch_size, directory)
+        for doc_id, text_content, metadata in timer.iterate("read", loaded, every=write_batch_size):
+            entry = _manifest_entry(doc_id, text_content, metadata, entries, chunk_config, incremental, file_stats, stats)
+            if entry is None:
+                continue
+
+            with timer.stage("chunk"):
+                rows = chunk_document(doc_id, text_content, chunk_strategy, chunk_size, chunk_overlap, metadata)
+            pending.extend(rows)
+            pending_entries[doc_id] = dict(entry, chunks=len(rows))
+
+            # Flush on document boundaries so every batch carries all chunks of its documents
+            if len(pending) >= write_batch_size:
+                flush(pending, pending_entries)
+                pending = []
+                pending_entries = {}
+
+        if pending:
+            flush(pending, pending_entries)
+
+        _finish_ingest(manifest, file_stats, stats, compact, timer)
+
+    except Exception as e:
+        logging.error(f"Error processing documents: {str(e)}")
+
+    return _report_stats(stats, start_time, timer)
+
+
+def process_documents_parallel(
+    directory=base_dir,
+    num_processes=DEFAULT_NUM_PROCESSES,
+    write_batch_size=DEFAULT_WRITE_BATCH_SIZE,
+    encode_batch_size=DEFAULT_ENCODE_BATCH_SIZE,
+    num_workers=DEFAULT_NUM_WORKERS,
+    compact=True,
+    chunk_strategy=DEFAULT_CHUNK_STRATEGY,
+    chunk_size=DEFAULT_CHUNK_SIZE,
+    chunk_overlap=DEFAULT_CHUNK_OVERLAP,
+    incremental=False,
+    docs_per_task=DEFAULT_DOCS_PER_TASK,
+    checkpoint_seconds=DEFAULT_CHECKPOINT_SECONDS
+):
+    """Ingest `directory` with chunking and encoding spread over `num_processes` processes.
+
+    Each process loads its own copy of the embedding model with an equal share
+    of the CPU threads and turns shards of `docs_per_task` documents into Arrow
+    record batches. This process reads the files, keeps at most two shards per
+    worker in flight, and is the only writer: returned batches are upserted
+    about `write_batch_size` rows at a time exactly as in `process_documents`.
+
+    The manifest is checkpointed every `checkpoint_seconds` with the documents
+    written so far, so an interrupted run resumes where it stopped when re-run
+    with `incremental=True` (e.g. via `sync_documents`). Progress is available
+    from `get_ingest_progress` while the job runs.
+
+    Returns:
+        Dict: The same statistics as `process_documents`, plus `failed` documents,
+        `unreadable` (empty or invalid) files and the number of `processes` used.
+    """
+    start_time = time.perf_counter()
+    timer = StageTimer("ingest")
+    stats = {"documents": 0, "chunks": 0, "skipped": 0, "removed": 0, "batches": 0, "failed": 0, "unreadable": 0,
+             "processes": num_processes}
+
+    manifest = load_manifest()
+    entries = manifest.setdefault("documents", {})
+    chunk_config = f"{chunk_strategy}:{chunk_size}:{chunk_overlap}"
+    file_stats = {}
+    threads = max(1, (os.cpu_count() or 1) // num_processes)
+
+    pending_batches = []
+    pending_entries = {}
+    last_checkpoint = time.perf_counter()
+
+    def flush():
+        batch = pa.Table.from_batches(pending_batches, schema=schema)
+        written = _upsert_batch(batch, sorted(pending_entries), timer)
+        if written == batch.num_rows:
+            entries.update(pending_entries)
+            stats["chunks"] += written
+            stats["documents"] += len(pending_entries)
+        else:
+            stats["failed"] += len(pending_entries)
+        stats["batches"] += 1
+        pending_batches.clear()
+        pending_entries.clear()
+
+    def collect(future, shard_entries):
+        nonlocal last_checkpoint
+        try:
+            batch, chunk_counts = future.result()
+        except Exception as e:
+            logging.error(f"Error embedding a shard of {len(shard_entries)} documents: {str(e)}")
+            stats["failed"] += len(shard_entries)
+            return
+
+        for doc_id, chunks in chunk_counts.items():
+            pending_entries[doc_id] = dict(shard_entries[doc_id], chunks=chunks)
+        if batch is not None:
+            pending_batches.append(batch)
+        if sum(pending.num_rows for pending in pending_batches) >= write_batch_size:
+            flush()
+
+        if time.perf_counter() - last_checkpoint >= checkpoint_seconds:
+            with timer.stage("manifest"):
+                save_manifest(manifest)
+            last_checkpoint = time.perf_counter()
+        _update_progress(stats, start_time)
+
+    try:
+        with timer.stage("list"):
+            paths = list(_candidate_paths(directory, entries, chunk_config, incremental, file_stats, stats))
+        ingest_progress.clear()
+        ingest_progress.update(state="running", processes=num_processes, total=len(paths) + stats["skipped"])
+        logging.info(f"Ingesting {len(paths)} documents with {num_processes} processes x {threads} threads")
+
+        executor = ProcessPoolExecutor(
+            max_workers=num_processes,
+            mp_context=multiprocessing.get_context("spawn"),  # Forked torch/tokenizer state is not safe to reuse
+            initializer=ingest_worker.init_worker,
+            initargs=(embedding_cache.model_name, embedding_cache.backend, threads, schema, encode_batch_size)
+        )
+        with executor:
+            in_flight = {}
+            shard = []
+            shard_entries = {}
+            loaded = iter_loaded_documents(paths, num_workers, write_batch_size, directory, stats)
+            for doc_id, text_content, metadata in timer.iterate("read", loaded, every=write_batch_size):
+                entry = _manifest_entry(doc_id, text_content, metadata, entries, chunk_config, incremental, file_stats, stats)
+                if entry is None:
+                    continue
+                shard.append((doc_id, text_content, metadata))
+                shard_entries[doc_id] = entry
+                if len(shard) < docs_per_task:
+                    continue
+
+                future = executor.submit(ingest_worker.embed_task, shard, chunk_strategy, chunk_size, chunk_overlap)
+                in_flight[future] = shard_entries
+                shard = []
+                shard_entries = {}
+
+                # Bound the documents held in memory while workers catch up
+                if len(in_flight) >= 2 * num_processes:
+                    with timer.stage("wait"):
+                        done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        collect(future, in_flight.pop(future))
+
+            if shard:
+                future = executor.submit(ingest_worker.embed_task, shard, chunk_strategy, chunk_size, chunk_overlap)
+                in_flight[future] = shard_entries
+            with timer.stage("wait"):
+                done, _ = wait(in_flight)
+            for future in done:
+                collect(future, in_flight.pop(future))
+
+        if pending_batches or pending_entries:
+            flush()
+
+        _finish_ingest(manifest, file_stats, stats, compact, timer)
+        ingest_progress["state"] = "done"
+
+    except Exception as e:
+        logging.error(f"Error processing documents: {str(e)}")
+        ingest_progress["state"] = "failed"
+        # Keep what was written so a re-run with incremental=True resumes from here
+        try:
+            save_manifest(manifest)
+        except Exception as save_error:
+            logging.error(f"Could not checkpoint manifest: {str(save_error)}")
+
+    _update_progress(stats, start_time)
+    return _report_stats(stats, start_time, timer)
+
+
+def _update_progress(stats, start_time):
+    """Refresh `ingest_progress` from the running statistics and log it every few seconds."""
+    global _last_progress_log
+    elapsed = time.perf_counter() - start_time
+    # Every listed file ends up in exactly one of these, so `done` reaches `total`
+    done = stats["documents"] + stats["skipped"] + stats["failed"] + stats.get("unreadable", 0)
+    docs_per_sec = stats["documents"] / elapsed if elapsed > 0 else 0.0
+    total = ingest_progress.get("total")
+    remaining = max(total - done, 0) if total is not None else None
+    ingest_progress.update(
+        documents=stats["documents"],
+        chunks=stats["chunks"],
+        skipped=stats["skipped"],
+        failed=stats["failed"],
+        unreadable=stats.get("unreadable", 0),
+        seconds=round(elapsed, 3),
+        docs_per_sec=round(docs_per_sec, 2),
+        eta_seconds=round(remaining / docs_per_sec, 1) if remaining is not None and docs_per_sec > 0 else None
+    )
+
+    if time.perf_counter() - _last_progress_log >= PROGRESS_LOG_SECONDS:
+        _last_progress_log = time.perf_counter()
+        logging.info(
+            f"Ingest progress: {done}/{total} documents ({ingest_progress['docs_per_sec']} docs/sec, "
+            f"ETA {ingest_progress['eta_seconds']}s)"
+        )
+
+
+def get_ingest_progress():
+    """Return a snapshot of the current or last multi-process ingestion job."""
+    return dict(ingest_progress)
+
+
+def sync_documents(directory=base_dir, **options):
+    """Re-embed only new or changed documents and drop rows of removed ones."""
+    return process_documents(directory, incremental=True, **options)
+
+
+def _write_batch(rows, encode_batch_size, timer=None):
+    """Encode and upsert one batch of chunk rows, returning the number of rows written."""
+    try:
+        timer = timer or StageTimer("ingest")
+        doc_ids = sorted({row["doc_id"] for row in rows})
+        batch = build_record_batch(rows, encode_batch_size, timer)
+    except Exception as e:
+        logging.error(f"Error adding data to collection: {str(e)}")
+        return 0
+    return _upsert_batch(pa.Table.from_batches([batch]), doc_ids, timer)
+
+
+def _upsert_batch(table, doc_ids, timer):
+    """Upsert an Arrow table of encoded chunks, returning the number of rows written.
+
+    Rows are merged on `text_id`; chunks left over from a longer previous version
+    of the same documents are deleted in the same operation.
+    """
+    try:
+        with timer.stage("write"):
+            (
+                collection.merge_insert("text_id")
+                .when_matched_update_all()
+                .when_not_matched_insert_all()
+                .when_not_matched_by_source_delete(sql_in("doc_id", doc_ids))
+                .execute(table)
+            )
+        logging.debug(f"Stored batch of {table.num_rows} chunks in LanceDB.")
+        return table.num_rows
+    except Exception as e:
+        logging.error(f"Error adding data to collection: {str(e)}")
+        return 0
+
+
+
+# Run the process
+if __name__ == "__main__":
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper())
+    print(process_documents())
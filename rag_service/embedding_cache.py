@@ -0,0 +1,299 @@
+# embedding_cache.py
+import asyncio
+import atexit
+import hashlib
+import logging
+import threading
+from datetime import timedelta
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from model_registry import get_model, model_id, DEFAULT_BACKEND
+from filters import sql_in
+from micro_batcher import MicroBatcher, DEFAULT_MAX_BATCH_SIZE, DEFAULT_MAX_WAIT_MS
+
+import numpy as np
+import pyarrow as pa
+
+# Embedding cache defaults
+DEFAULT_MEMORY_SIZE = 50_000  # Vectors kept in the in-memory LRU
+DEFAULT_ENCODE_WORKERS = 2  # Threads that run model inference for async callers
+DEFAULT_FLUSH_SIZE = 256  # New vectors buffered before a disk write is triggered
+DEFAULT_FLUSH_SECONDS = 5.0  # Longest a new vector waits in the buffer
+DEFAULT_COMPACT_EVERY = 50  # Disk writes between compactions of the cache table
+CACHE_TABLE_NAME = "embedding_cache"
+
+
+class EmbeddingCache:
+    """Cache of embeddings keyed by model name and text hash.
+
+    Lookups go to an in-memory LRU first, then to a LanceDB table that persists
+    across restarts. Only texts missing from both are encoded, in one batched
+    call, and the results are written back to both layers. Vectors of different
+    embedding backends are cached separately.
+
+    Disk writes are buffered and flushed in batches by a background thread, so a
+    miss never waits on LanceDB and the table gets one version per flush instead
+    of one per request. The table is compacted every `compact_every` flushes.
+    """
+
+    def __init__(self, model_name, db, embedding_dim, memory_size=DEFAULT_MEMORY_SIZE,
+                 encode_workers=DEFAULT_ENCODE_WORKERS, max_batch_size=DEFAULT_MAX_BATCH_SIZE,
+                 max_wait_ms=DEFAULT_MAX_WAIT_MS, backend=DEFAULT_BACKEND, flush_size=DEFAULT_FLUSH_SIZE,
+                 flush_seconds=DEFAULT_FLUSH_SECONDS, compact_every=DEFAULT_COMPACT_EVERY):
+        self.model_name = model_name
+        self.backend = backend
+        # Cache namespace, e.g. "all-MiniLM-L6-v2@onnx_int8"
+        self.model_key = model_id(model_name, backend)
+        self._dimension_checked = False
+        self.embedding_dim = embedding_dim
+        self.memory_size = memory_size
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        # Write-behind buffer for the disk layer
+        self.flush_size = flush_size
+        self.flush_seconds = flush_seconds
+        self.compact_every = compact_every
+        self._pending = {}
+        self._flushing = {}
+        self._flush_lock = threading.Lock()
+        self._flush_event = threading.Event()
+        self._flush_thread = None
+        self.flushes = 0
+        self._key_indexed = False
+
+        # Bounded so CPU-heavy inference never starves the event loop's default threadpool
+        self._executor = ThreadPoolExecutor(max_workers=encode_workers, thread_name_prefix="embed")
+
+        # Concurrent async callers are coalesced into one batched encode
+        self.batcher = MicroBatcher(self.encode, self._executor, max_batch_size, max_wait_ms)
+
+        self.schema = pa.schema([
+            pa.field("key", pa.string()),
+            pa.field("model", pa.string()),
+            pa.field("vector", pa.list_(pa.float32(), embedding_dim))
+        ])
+        try:
+            if CACHE_TABLE_NAME in db:
+                self.table = db[CACHE_TABLE_NAME]
+            else:
+                self.table = db.create_table(CACHE_TABLE_NAME, schema=self.schema, mode="create")
+        except Exception as e:
+            logging.warning(f"Embedding cache will be memory-only: {str(e)}")
+            self.table = None
+
+        if self.table is not None:
+            self._ensure_key_index()
+            atexit.register(self.flush)
+
+    @property
+    def model(self):
+        model = get_model(self.model_name, self.backend)
+        if not self._dimension_checked:
+            # Every backend must produce vectors that fit the table schema
+            dimension = model.get_sentence_embedding_dimension()
+            if dimension != self.embedding_dim:
+                raise ValueError(
+                    f"Embedding model '{self.model_key}' produces {dimension}-d vectors, expected {self.embedding_dim}"
+                )
+            self._dimension_checked = True
+        return model
+
+    def key(self, text):
+        return hashlib.sha256(f"{self.model_key}\0{text}".encode("utf-8")).hexdigest()
+
+    def encode(self, texts, batch_size=32, use_cache=True):
+        """Return embeddings for `texts` as float32 numpy arrays, encoding only cache misses.
+
+        A single string returns a 1-D vector, a list returns a 2-D array, matching
+        `SentenceTransformer.encode`.
+        """
+        single = isinstance(texts, str)
+        if single:
+            texts = [texts]
+        if not use_cache:
+            vectors = self.model.encode(texts, batch_size=batch_size, convert_to_numpy=True).astype(np.float32)
+            return vectors[0] if single else vectors
+
+        keys = [self.key(text) for text in texts]
+        found = self._get_memory(keys)
+
+        missing = [key for key in dict.fromkeys(keys) if key not in found]
+        if missing:
+            from_disk = self._get_disk(missing)
+            found.update(from_disk)
+            self._put_memory(from_disk)
+
+        to_encode = {}
+        for key, text in zip(keys, texts):
+            if key not in found:
+                to_encode.setdefault(key, text)
+        if to_encode:
+            encoded = self.model.encode(list(to_encode.values()), batch_size=batch_size, convert_to_numpy=True)
+            new_vectors = {key: vector.astype(np.float32) for key, vector in zip(to_encode, encoded)}
+            found.update(new_vectors)
+            self._put_memory(new_vectors)
+            self._put_disk(new_vectors)
+
+        with self._lock:
+            self.misses += len(to_encode)
+
+        vectors = np.stack([found[key] for key in keys]) if keys else np.empty((0, self.embedding_dim), np.float32)
+        return vectors[0] if single else vectors
+
+    async def aencode(self, texts, batch_size=32, use_cache=True):
+        """Async `encode`: runs on the dedicated embedding executor instead of the event loop.
+
+        Cached lookups go through the micro-batcher, so requests arriving together
+        share one forward pass.
+        """
+        if not use_cache:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, self.encode, texts, batch_size, use_cache)
+
+        single = isinstance(texts, str)
+        vectors = await self.batcher.submit([texts] if single else texts)
+        return vectors[0] if single else vectors
+
+    def stats(self):
+        """Return hit/miss counters and sizes for reporting."""
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                "model": self.model_name,
+                "backend": self.backend,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.memory_hits + self.disk_hits) / lookups, 4) if lookups else 0.0,
+                "memory_entries": len(self._memory),
+                "pending_writes": len(self._pending) + len(self._flushing),
+                "flushes": self.flushes,
+                "disk_entries": self.table.count_rows() if self.table is not None else 0
+            }
+
+    def _get_memory(self, keys):
+        found = {}
+        with self._lock:
+            for key in keys:
+                vector = self._memory.get(key)
+                if vector is not None:
+                    self._memory.move_to_end(key)
+                    found[key] = vector
+            # Per unique key, like misses
+            self.memory_hits += len(found)
+        return found
+
+    def _put_memory(self, vectors):
+        with self._lock:
+            for key, vector in vectors.items():
+                self._memory[key] = vector
+                self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_size:
+                self._memory.popitem(last=False)
+
+    def _get_disk(self, keys):
+        if self.table is None:
+            return {}
+        found = {}
+        with self._lock:
+            # Vectors not yet flushed are served from the write buffer
+            for key in keys:
+                vector = self._pending.get(key)
+                if vector is None:
+                    vector = self._flushing.get(key)
+                if vector is not None:
+                    found[key] = vector
+        keys = [key for key in keys if key not in found]
+        if keys:
+            try:
+                rows = self.table.search().where(sql_in("key", keys)).limit(len(keys)).to_arrow()
+                found.update(
+                    (key, np.asarray(vector, dtype=np.float32))
+                    for key, vector in zip(rows["key"].to_pylist(), rows["vector"].to_pylist())
+                )
+            except Exception as e:
+                logging.warning(f"Embedding cache lookup failed: {str(e)}")
+        with self._lock:
+            self.disk_hits += len(found)
+        return found
+
+    def _put_disk(self, vectors):
+        """Buffer new vectors for the background writer."""
+        if self.table is None:
+            return
+        with self._lock:
+            self._pending.update(vectors)
+            full = len(self._pending) >= self.flush_size
+            if self._flush_thread is None:
+                self._flush_thread = threading.Thread(target=self._flush_loop, name="embedding-cache-flush",
+                                                      daemon=True)
+                self._flush_thread.start()
+        if full:
+            self._flush_event.set()
+
+    def _flush_loop(self):
+        while True:
+            self._flush_event.wait(self.flush_seconds)
+            self._flush_event.clear()
+            self.flush()
+
+    def flush(self):
+        """Write buffered vectors to the cache table in one merge, compacting it periodically."""
+        if self.table is None:
+            return
+        with self._flush_lock:
+            with self._lock:
+                if not self._pending:
+                    return
+                self._flushing, self._pending = self._pending, {}
+            try:
+                data = pa.table(
+                    {
+                        "key": list(self._flushing.keys()),
+                        "model": [self.model_key] * len(self._flushing),
+                        "vector": [vector.tolist() for vector in self._flushing.values()]
+                    },
+                    schema=self.schema
+                )
+                self.table.merge_insert("key").when_not_matched_insert_all().execute(data)
+                self.flushes += 1
+                logging.debug(f"Flushed {len(self._flushing)} embeddings to the cache table")
+            except Exception as e:
+                logging.warning(f"Could not persist embeddings to cache: {str(e)}")
+            finally:
+                with self._lock:
+                    self._flushing = {}
+
+            if not self._key_indexed:
+                self._ensure_key_index()
+            elif self.flushes % self.compact_every == 0:
+                self._compact()
+
+    def _ensure_key_index(self):
+        """Index `key` so lookups do not scan every fragment of the cache table."""
+        try:
+            if any("key" in index.columns for index in self.table.list_indices()):
+                self._key_indexed = True
+                return
+            if self.table.count_rows() == 0:
+                return
+            self.table.create_scalar_index("key", index_type="BTREE")
+            self._key_indexed = True
+        except Exception as e:
+            logging.warning(f"Could not create scalar index on embedding cache keys: {str(e)}")
+
+    def _compact(self):
+        """Merge flush fragments, drop old table versions and fold new rows into the key index."""
+        try:
+            if hasattr(self.table, "optimize"):
+                self.table.optimize(cleanup_older_than=timedelta(minutes=1))
+            else:
+                self.table.compact_files()
+                self.table.cleanup_old_versions(older_than=timedelta(minutes=1))
+            logging.info(f"Compacted embedding cache table after {self.flushes} flushes")
+        except Exception as e:
+            logging.warning(f"Could not compact embedding cache table: {str(e)}")
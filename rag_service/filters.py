@@ -0,0 +1,42 @@
+# filters.py
+
+# Columns that search requests may filter on
+FILTER_COLUMNS = ("category", "doc_id", "source_file", "doc_date")
+RANGE_OPERATORS = {"gt": ">", "gte": ">=", "lt": "<", "lte": "<="}
+
+
+def sql_literal(value):
+    """Quote a value for LanceDB's SQL dialect."""
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def sql_in(column, values):
+    """Build a `column IN (...)` filter, quoting each value for LanceDB's SQL dialect."""
+    return f"{column} IN ({', '.join(sql_literal(value) for value in values)})"
+
+
+def build_where(filters):
+    """Translate request filters into a SQL predicate for a pre-filtered search.
+
+    Each key must be one of `FILTER_COLUMNS`. A string matches exactly, a list
+    matches any of its values, and a dict of `gt`/`gte`/`lt`/`lte` bounds
+    matches a range (e.g. `{"doc_date": {"gte": "2024-01-01"}}`).
+
+    Returns:
+        str: The predicate, or None when there is nothing to filter on.
+    """
+    clauses = []
+    for column, value in (filters or {}).items():
+        if column not in FILTER_COLUMNS:
+            raise ValueError(f"Cannot filter on '{column}', expected one of {FILTER_COLUMNS}")
+        if isinstance(value, dict):
+            for operator, bound in value.items():
+                if operator not in RANGE_OPERATORS:
+                    raise ValueError(f"Unknown range operator '{operator}', expected one of {tuple(RANGE_OPERATORS)}")
+                clauses.append(f"{column} {RANGE_OPERATORS[operator]} {sql_literal(bound)}")
+        elif isinstance(value, (list, tuple)):
+            if value:
+                clauses.append(sql_in(column, value))
+        else:
+            clauses.append(f"{column} = {sql_literal(value)}")
+    return " AND ".join(clauses) if clauses else None
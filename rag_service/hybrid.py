@@ -0,0 +1,31 @@
+# hybrid.py
+
+# Hybrid retrieval defaults
+SEARCH_MODES = ("vector", "keyword", "hybrid")
+DEFAULT_RRF_K = 60  # Damps the weight of top ranks, as in the original RRF paper
+DEFAULT_CANDIDATE_FACTOR = 4  # Each ranker contributes k * factor candidates to the fusion
+
+
+def reciprocal_rank_fusion(result_lists, weights, k, rrf_k=DEFAULT_RRF_K, key="text_id"):
+    """Fuse ranked result lists with weighted reciprocal-rank fusion.
+
+    Each row scores `sum(weight / (rrf_k + rank))` over the lists it appears in
+    (rank starting at 1). Rows are merged on `key` and the fused score is stored
+    in `_relevance_score`.
+
+    Returns:
+        List[Dict]: The top `k` fused rows, best first.
+    """
+    fused = {}
+    for results, weight in zip(result_lists, weights):
+        if not weight:
+            continue
+        for rank, row in enumerate(results, start=1):
+            entry = fused.setdefault(row[key], {"row": dict(row), "score": 0.0})
+            entry["row"].update({name: value for name, value in row.items() if name not in entry["row"]})
+            entry["score"] += weight / (rrf_k + rank)
+
+    ranked = sorted(fused.values(), key=lambda entry: entry["score"], reverse=True)[:k]
+    for entry in ranked:
+        entry["row"]["_relevance_score"] = entry["score"]
+    return [entry["row"] for entry in ranked]
@@ -0,0 +1,238 @@
+# index_manager.py
+import json
+import logging
+import math
+import os
+import threading
+import time
+
+# Index sizing thresholds (in rows)
+FLAT_MAX_ROWS = 10_000  # Below this an exact scan is fast enough, so no ANN index is kept
+HNSW_MAX_ROWS = 500_000  # Up to this IVF_HNSW_SQ gives the best recall/latency trade-off, above it IVF_PQ
+REBUILD_GROWTH_FACTOR = 2.0  # Retrain partitions once the table has grown this much since the last build
+OPTIMIZE_MIN_UNINDEXED = 1_000  # Fold new rows into the existing index once this many are unindexed
+
+INDEX_TYPES = ("FLAT", "IVF_HNSW_SQ", "IVF_PQ")
+
+
+def choose_index_params(row_count, embedding_dim, index_type=None):
+    """Pick an index type and its partition/sub-vector counts for `row_count` rows.
+
+    Args:
+        row_count (int): Number of rows in the table.
+        embedding_dim (int): Vector dimension, used to size PQ sub-vectors.
+        index_type (str): Force a type instead of choosing one from `row_count`.
+
+    Returns:
+        Dict: `index_type` plus the keyword arguments for `create_index`.
+    """
+    if index_type is None:
+        if row_count < FLAT_MAX_ROWS:
+            index_type = "FLAT"
+        elif row_count <= HNSW_MAX_ROWS:
+            index_type = "IVF_HNSW_SQ"
+        else:
+            index_type = "IVF_PQ"
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type '{index_type}', expected one of {INDEX_TYPES}")
+
+    if index_type == "FLAT":
+        return {"index_type": "FLAT"}
+    if index_type == "IVF_HNSW_SQ":
+        # Each partition holds its own HNSW graph, so a few large partitions are enough
+        return {"index_type": index_type, "num_partitions": max(1, row_count // 100_000)}
+
+    # IVF_PQ: ~sqrt(N) partitions and 8 dimensions per sub-vector
+    sub_vector_dim = 8 if embedding_dim % 8 == 0 else 1
+    return {
+        "index_type": index_type,
+        "num_partitions": max(1, int(math.sqrt(row_count))),
+        "num_sub_vectors": embedding_dim // sub_vector_dim
+    }
+
+
+class IndexManager:
+    """Keep the vector index of a LanceDB table in step with its size.
+
+    The last build is recorded in a small JSON state file so staleness survives
+    restarts. `maybe_rebuild` is cheap to call after every ingestion.
+    """
+
+    def __init__(self, collection, embedding_dim, state_path, vector_column="vector", text_column="original_text",
+                 scalar_columns=()):
+        self.collection = collection
+        self.embedding_dim = embedding_dim
+        self.state_path = state_path
+        self.vector_column = vector_column
+        self.text_column = text_column
+        self.scalar_columns = tuple(scalar_columns)
+        self._lock = threading.Lock()
+        self.state = self._load_state()
+
+    def status(self):
+        """Describe the current index and how far it lags behind the table."""
+        row_count = self.collection.count_rows()
+        recommended = choose_index_params(row_count, self.embedding_dim)
+        index_type = self.state.get("index_type", "FLAT")
+        rows_at_build = self.state.get("rows_at_build", 0)
+        unindexed = self._unindexed_rows(row_count)
+
+        return {
+            "index_type": index_type,
+            "params": self.state.get("params", {}),
+            "built_at": self.state.get("built_at"),
+            "rows": row_count,
+            "rows_at_build": rows_at_build,
+            "unindexed_rows": unindexed,
+            "recommended": recommended,
+            "stale": self._needs_rebuild(row_count, recommended) or unindexed >= OPTIMIZE_MIN_UNINDEXED,
+            "fts_rows_at_build": self.state.get("fts_rows_at_build"),
+            "fts_stale": self.state.get("fts_rows_at_build") != row_count,
+            "scalar_indexes": self.state.get("scalar_indexes", [])
+        }
+
+    def has_index(self):
+        return self.state.get("index_type", "FLAT") != "FLAT"
+
+    def build(self, index_type=None):
+        """(Re)build the vector index, choosing its parameters from the current row count."""
+        with self._lock:
+            row_count = self.collection.count_rows()
+            params = choose_index_params(row_count, self.embedding_dim, index_type)
+            if params["index_type"] != "FLAT":
+                self.collection.create_index(
+                    vector_column_name=self.vector_column,
+                    replace=True,
+                    **params
+                )
+            else:
+                self._drop_index()
+
+            self.state.update({
+                "index_type": params["index_type"],
+                "params": {k: v for k, v in params.items() if k != "index_type"},
+                "rows_at_build": row_count,
+                "built_at": time.time()
+            })
+            self._save_state()
+            logging.info(f"Built {params['index_type']} index over {row_count} rows with {self.state['params']}")
+            return self.state
+
+    def build_fts(self):
+        """(Re)build the BM25 full-text index on the text column used by hybrid search."""
+        with self._lock:
+            row_count = self.collection.count_rows()
+            if row_count > 0:
+                self.collection.create_fts_index(self.text_column, replace=True)
+            self.state["fts_rows_at_build"] = row_count
+            self._save_state()
+            logging.info(f"Built full-text index on '{self.text_column}' over {row_count} rows")
+
+    def build_scalar_indexes(self):
+        """(Re)build the scalar indexes that serve metadata pre-filters."""
+        with self._lock:
+            built = []
+            for column in self.scalar_columns:
+                try:
+                    self.collection.create_scalar_index(column, replace=True)
+                    built.append(column)
+                except Exception as e:
+                    logging.warning(f"Could not create scalar index on '{column}': {str(e)}")
+            self.state["scalar_indexes"] = built
+            self._save_state()
+            logging.info(f"Built scalar indexes on {built}")
+
+    def optimize(self):
+        """Add unindexed rows to the existing index without retraining its partitions."""
+        with self._lock:
+            if hasattr(self.collection, "optimize"):
+                self.collection.optimize()
+            else:
+                self.collection.compact_files()
+            logging.info("Optimized vector index")
+
+    def maybe_rebuild(self, data_changed=False):
+        """Rebuild or optimize the index if ingestion has pushed it past a threshold.
+
+        The full-text index is rebuilt whenever the row count moved or the caller
+        reports `data_changed` (upserts can rewrite text without changing the count).
+
+        Returns:
+            str: "built", "optimized" or "unchanged" for the vector index.
+        """
+        try:
+            row_count = self.collection.count_rows()
+            if data_changed or self.state.get("fts_rows_at_build") != row_count:
+                self.build_fts()
+
+            if row_count > 0 and set(self.state.get("scalar_indexes", [])) != set(self.scalar_columns):
+                self.build_scalar_indexes()
+
+            recommended = choose_index_params(row_count, self.embedding_dim)
+            if self._needs_rebuild(row_count, recommended):
+                self.build()
+                if row_count > 0:
+                    self.build_scalar_indexes()
+                return "built"
+            if self.has_index() and self._unindexed_rows(row_count) >= OPTIMIZE_MIN_UNINDEXED:
+                self.optimize()
+                return "optimized"
+        except Exception as e:
+            logging.warning(f"Could not update index: {str(e)}")
+        return "unchanged"
+
+    def apply_search_params(self, query, nprobes=None, refine_factor=None):
+        """Set per-query ANN parameters; they are ignored when the table has no index."""
+        if not self.has_index():
+            return query
+        if nprobes is not None:
+            query = query.nprobes(nprobes)
+        if refine_factor is not None:
+            query = query.refine_factor(refine_factor)
+        return query
+
+    def _needs_rebuild(self, row_count, recommended):
+        index_type = self.state.get("index_type", "FLAT")
+        if recommended["index_type"] != index_type:
+            return True
+        if index_type == "FLAT":
+            return False
+        rows_at_build = self.state.get("rows_at_build", 0)
+        return row_count >= rows_at_build * REBUILD_GROWTH_FACTOR
+
+    def _unindexed_rows(self, row_count):
+        if not self.has_index():
+            return 0
+        try:
+            stats = self.collection.index_stats(f"{self.vector_column}_idx")
+            if stats is not None:
+                return stats.num_unindexed_rows
+        except Exception:
+            pass
+        # Fall back to the rows added since the last build
+        return max(0, row_count - self.state.get("rows_at_build", 0))
+
+    def _drop_index(self):
+        if not self.has_index():
+            return
+        try:
+            self.collection.drop_index(f"{self.vector_column}_idx")
+        except Exception as e:
+            logging.warning(f"Could not drop index: {str(e)}")
+
+    def _load_state(self):
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            logging.warning(f"Could not read index state {self.state_path}: {str(e)}")
+            return {}
+
+    def _save_state(self):
+        os.makedirs(os.path.dirname(self.state_path), exist_ok=True)
+        tmp_path = self.state_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.state, f, indent=2)
+        os.replace(tmp_path, self.state_path)
@@ -0,0 +1,59 @@
+# ingest_worker.py
+import numpy as np
+import pyarrow as pa
+from chunking import chunk_document
+from model_registry import get_model
+
+# Runs inside ingestion worker processes. It must not import db_config (or
+# anything that does), since that would open the database in every worker.
+
+# Set once per worker process by init_worker
+_worker = {}
+
+
+def init_worker(model_name, backend, threads, schema, encode_batch_size):
+    """Load this process's own copy of the embedding model."""
+    _worker.update(
+        model=get_model(model_name, backend, threads),
+        schema=schema,
+        encode_batch_size=encode_batch_size
+    )
+
+
+def embed_task(documents, chunk_strategy, chunk_size, chunk_overlap):
+    """Chunk and encode a shard of documents into one Arrow record batch.
+
+    Args:
+        documents (List[Tuple]): `(doc_id, text_content, metadata)` per document.
+
+    Returns:
+        Tuple: The record batch (None if no document produced a chunk) and the
+        number of chunks per `doc_id`.
+    """
+    rows = []
+    chunk_counts = {}
+    for doc_id, text_content, metadata in documents:
+        doc_rows = chunk_document(doc_id, text_content, chunk_strategy, chunk_size, chunk_overlap, metadata)
+        rows.extend(doc_rows)
+        chunk_counts[doc_id] = len(doc_rows)
+    if not rows:
+        return None, chunk_counts
+
+    schema = _worker["schema"]
+    embeddings = np.asarray(
+        _worker["model"].encode(
+            [row["original_text"] for row in rows],
+            batch_size=_worker["encode_batch_size"],
+            convert_to_numpy=True
+        ),
+        dtype=np.float32
+    )
+
+    # Vectors go in as one flat buffer rather than a Python list per row
+    columns = []
+    for field in schema:
+        if field.name == "vector":
+            columns.append(pa.FixedSizeListArray.from_arrays(pa.array(embeddings.ravel()), embeddings.shape[1]))
+        else:
+            columns.append(pa.array([row[field.name] for row in rows], type=field.type))
+    return pa.RecordBatch.from_arrays(columns, schema=schema), chunk_counts
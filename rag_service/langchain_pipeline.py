@@ -1,6 +1,17 @@
 # langchain_pipeline.py
-from sentence_transformers import SentenceTransformer
 from langchain.prompts import PromptTemplate
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from db_config import embedding_cache, index_manager, semantic_cache
+from async_db import get_async_collection
+from filters import build_where
+from context_builder import select_passages, DEFAULT_TOKEN_BUDGET, DEFAULT_DEDUP_THRESHOLD
+from hybrid import reciprocal_rank_fusion, SEARCH_MODES, DEFAULT_CANDIDATE_FACTOR
+from rag_common.stage_timing import StageTimer
+from rag_common.llm_backends import generation_cache_for, split_tokens
+from langchain_core.outputs import Generation
 
 # **TODO 1**: Set up the `SentenceTransformer` model to generate embeddings and build a prompt template for enhancing user prompts with contextual information.
 # ```plaintext
@@ -11,8 +22,17 @@ from langchain.prompts import PromptTemplate
 #     - Format the template to place the query at the top, followed by "Contextual Info:" and the context content on a new line.
 # ```
 
-# Initialize the SentenceTransformer model
-model = SentenceTransformer('all-MiniLM-L6-v2')
+# Queries are embedded through db_config.embedding_cache, which shares the one
+# SentenceTransformer instance held by model_registry
+
+# Batch retrieval defaults
+DEFAULT_LLM_CONCURRENCY = 8
+
+DISTANCE_METRICS = ("l2", "cosine", "dot")
+
+# LLMs whose tokenizer could not be loaded; pipelines are built per request, so this
+# is process-wide to try, and warn, only once per LLM
+_tokenizer_unavailable = set()
 
 template = """
    {query}
@@ -48,44 +68,355 @@ class LangChainRetrievalPipeline:
     #    - `documents_used`: Metadata of the documents retrieved, providing context for the LLM response.
     # ```
     
-    def __init__(self, collection, llm_model):
+    def __init__(self, collection, llm_model, k=5, nprobes=None, refine_factor=None, use_semantic_cache=True,
+                 search_mode="vector", vector_weight=1.0, keyword_weight=1.0, filters=None,
+                 token_budget=DEFAULT_TOKEN_BUDGET, dedup_threshold=DEFAULT_DEDUP_THRESHOLD, mmr_lambda=None,
+                 timer=None, metric=None, columns=None, max_distance=None, min_score=None):
+        if search_mode not in SEARCH_MODES:
+            raise ValueError(f"Unknown search mode '{search_mode}', expected one of {SEARCH_MODES}")
+        if metric is not None and metric not in DISTANCE_METRICS:
+            raise ValueError(f"Unknown distance metric '{metric}', expected one of {DISTANCE_METRICS}")
+        if columns is not None:
+            unknown = [column for column in columns if column not in collection.schema.names]
+            if unknown:
+                raise ValueError(f"Unknown columns {unknown}, expected some of {collection.schema.names}")
         self.collection = collection
         self.llm_model = llm_model
+        self.k = k
+        self.nprobes = nprobes
+        self.refine_factor = refine_factor
+        self.search_mode = search_mode
+        self.vector_weight = vector_weight
+        self.keyword_weight = keyword_weight
+        # Metadata filters are applied before the ANN/BM25 search, not to its top-k
+        self.where = build_where(filters)
+        self.token_budget = token_budget
+        self.dedup_threshold = dedup_threshold
+        self.mmr_lambda = mmr_lambda
+        # Distance metric of the vector search; None keeps the table's default (L2)
+        self.metric = metric
+        # Columns to read for each hit (None reads all, including the vector); hybrid fusion needs text_id
+        self.columns = list(dict.fromkeys(["text_id", *columns])) if columns is not None else None
+        # Vector hits further than `max_distance` (before fusion in hybrid mode) and keyword/hybrid
+        # results scored below `min_score` are dropped
+        self.max_distance = max_distance
+        self.min_score = min_score
+        # Per-stage durations (encode, search, context, llm) of the calls made through this pipeline
+        self.timer = timer or StageTimer("rag")
+        # Keyword results depend on the exact query terms, which near-duplicate
+        # embeddings don't capture, so only pure vector searches are cached
+        self.use_semantic_cache = use_semantic_cache and search_mode == "vector"
 
-    def retrieve_and_enhance(self, query):
+    def retrieve(self, query):
+        """Return the top `k` chunk rows for `query`, closest first."""
         # Generate an embedding for the query
-        query_embedding = model.encode(query).tolist()
+        with self.timer.stage("encode"):
+            query_embedding = embedding_cache.encode(query)
+        with self.timer.stage("search"):
+            return self._search(query_embedding, query)
 
-        # Retrieve matching documents
-        retrieved_docs = self.collection.search(query_embedding)
+    def retrieve_and_enhance(self, query):
+        top_docs = self.select_context(query, self.retrieve(query))
+        enhanced_prompt = self.build_prompt(query, top_docs)
 
-        # Limit the results to the top 5
-        top_docs= retrieved_docs[:5]
+        # Generate a response from the language model
+        with self.timer.stage("llm"):
+            llm_response = self.llm_model.invoke(enhanced_prompt)
 
-        # Extract relevant text snippets from each document
-        context_texts = ""
-        for doc in top_docs:
-            context_texts += doc["original_text"][:200] + "..."  # Limit to 200 characters
+        return {
+            "enhanced_prompt": enhanced_prompt,
+            "llm_response": llm_response,
+            "documents_used": self.documents_metadata(top_docs)
+        }
 
-        # Format an enhanced prompt
-        enhanced_prompt = prompt_template.format(query=query, context=context_texts)
+    async def aretrieve(self, query):
+        """Async `retrieve`: encodes on the embedding executor and searches through LanceDB's async API."""
+        with self.timer.stage("encode"):
+            query_embedding = await embedding_cache.aencode(query)
+        with self.timer.stage("search"):
+            return await self._asearch(query_embedding, query)
 
-        # Generate a response from the language model
-        llm_response = self.llm_model.generate_response(enhanced_prompt)
+    async def aretrieve_batch(self, queries):
+        with self.timer.stage("encode"):
+            query_embeddings = await embedding_cache.aencode(list(queries))
+        with self.timer.stage("search"):
+            return await asyncio.gather(*(
+                self._asearch(query_embedding, query) for query_embedding, query in zip(query_embeddings, queries)
+            ))
+
+    async def aretrieve_and_enhance(self, query):
+        top_docs = self.select_context(query, await self.aretrieve(query))
+        enhanced_prompt = self.build_prompt(query, top_docs)
+
+        # The async client lets concurrent requests overlap their LLM latency
+        with self.timer.stage("llm"):
+            llm_response = await self.llm_model.ainvoke(enhanced_prompt)
+
+        return {
+            "enhanced_prompt": enhanced_prompt,
+            "llm_response": llm_response,
+            "documents_used": self.documents_metadata(top_docs)
+        }
+
+    async def astream_retrieve_and_enhance(self, query):
+        """Async `retrieve_and_enhance` that yields events as soon as each part is ready.
+
+        Yields a `context` event with the enhanced prompt and documents right after
+        retrieval, one `token` event per streamed LLM chunk, then a `done` event
+        carrying the full response. A response in the LLM's generation cache is
+        replayed as tokens, and a streamed one is written back to it.
+        """
+        top_docs = self.select_context(query, await self.aretrieve(query))
+        enhanced_prompt = self.build_prompt(query, top_docs)
+        yield {
+            "event": "context",
+            "enhanced_prompt": enhanced_prompt,
+            "documents_used": self.documents_metadata(top_docs)
+        }
+
+        chunks = []
+        started = time.perf_counter()
+        # astream skips the LLM cache, so look it up with the key generate() would use
+        cache, llm_string = generation_cache_for(self.llm_model)
+        cached = await cache.alookup(enhanced_prompt, llm_string) if cache is not None else None
+        if cached:
+            stream = _replay(cached[0].text)
+        else:
+            stream = self.llm_model.astream(enhanced_prompt)
+        async for chunk in stream:
+            if not chunks:
+                self.timer.record("llm_first_token", time.perf_counter() - started)
+            chunks.append(chunk)
+            yield {"event": "token", "text": chunk}
+        self.timer.record("llm", time.perf_counter() - started)
+
+        llm_response = "".join(chunks)
+        if cache is not None and not cached:
+            await cache.aupdate(enhanced_prompt, llm_string, [Generation(text=llm_response)])
+        yield {"event": "done", "llm_response": llm_response}
+
+    async def aretrieve_and_enhance_batch(self, queries, max_concurrency=DEFAULT_LLM_CONCURRENCY):
+        """Run `aretrieve_and_enhance` for many queries at once.
+
+        Retrieval is batched, and the LLM calls are fanned out with at most
+        `max_concurrency` in flight. A failing item does not fail the batch;
+        its result carries an `error` instead of an `llm_response`.
+
+        Returns:
+            List[Dict]: One result per query, in input order.
+        """
+        if not queries:
+            return []
+
+        retrieved = [
+            self.select_context(query, docs) for query, docs in zip(queries, await self.aretrieve_batch(queries))
+        ]
+        prompts = [self.build_prompt(query, top_docs) for query, top_docs in zip(queries, retrieved)]
+        with self.timer.stage("llm"):
+            responses = await self.llm_model.abatch(
+                prompts,
+                config={"max_concurrency": max_concurrency},
+                return_exceptions=True
+            )
+        return self._batch_results(queries, retrieved, prompts, responses)
 
-        # Prepare document metadata
+    def select_context(self, query, top_docs):
+        """Pack the best unique passages into the token budget (optionally diversified with MMR)."""
+        with self.timer.stage("context"):
+            query_embedding = embedding_cache.encode(query) if self.mmr_lambda is not None else None
+            return select_passages(
+                top_docs,
+                self.count_tokens,
+                token_budget=self.token_budget,
+                dedup_threshold=self.dedup_threshold,
+                query_embedding=query_embedding,
+                mmr_lambda=self.mmr_lambda
+            )
+
+    def count_tokens(self, text):
+        """Count tokens with the LLM's own tokenizer, estimating ~4 characters per token if it is unavailable."""
+        llm_key = (type(self.llm_model).__name__, getattr(self.llm_model, "model_name", None))
+        if llm_key not in _tokenizer_unavailable:
+            try:
+                return self.llm_model.get_num_tokens(text)
+            except Exception as e:
+                if llm_key not in _tokenizer_unavailable:
+                    _tokenizer_unavailable.add(llm_key)
+                    logging.warning(f"Tokenizer unavailable, estimating token counts: {str(e)}")
+        return len(text) // 4 + 1
+
+    def build_prompt(self, query, top_docs):
+        """Format the enhanced prompt from the query and the retrieved passages."""
+        # Each row is a whole passage, so pass it to the LLM untruncated
+        with self.timer.stage("prompt"):
+            context_texts = "\n\n".join(doc["original_text"] for doc in top_docs)
+            return prompt_template.format(query=query, context=context_texts)
+
+    def documents_metadata(self, top_docs):
+        """Prepare document metadata for the response."""
         documents_used = []
         for doc in top_docs:
             doc_metadata = {
                 "text_id": doc["text_id"],
-                "snippet": doc["original_text"][:200],
-                "score": doc.get("score", None)
+                "doc_id": doc.get("doc_id"),
+                "chunk_index": doc.get("chunk_index"),
+                "start_offset": doc.get("start_offset"),
+                "end_offset": doc.get("end_offset"),
+                "category": doc.get("category"),
+                "source_file": doc.get("source_file"),
+                "doc_date": doc.get("doc_date"),
+                "snippet": doc["original_text"],
+                "score": result_score(doc)
             }
             documents_used.append(doc_metadata) # Add metadata to the list
+        return documents_used
 
-        return {
-            "enhanced_prompt": enhanced_prompt,
-            "llm_response": llm_response,
-            "documents_used": documents_used
-        }
-    
\ No newline at end of file
+    def _batch_results(self, queries, retrieved, prompts, responses):
+        results = []
+        for query, top_docs, enhanced_prompt, response in zip(queries, retrieved, prompts, responses):
+            result = {
+                "query": query,
+                "enhanced_prompt": enhanced_prompt,
+                "documents_used": self.documents_metadata(top_docs)
+            }
+            if isinstance(response, Exception):
+                result["error"] = str(response)
+            else:
+                result["llm_response"] = response
+            results.append(result)
+        return results
+
+    def _search_params(self):
+        """Everything besides the query vector that shapes a search's results."""
+        columns = tuple(self.columns) if self.columns is not None else None
+        return (self.k, self.nprobes, self.refine_factor, self.where, self.metric, columns)
+
+    def _apply_cutoffs(self, results):
+        if self.min_score is not None and self.search_mode != "vector":
+            results = [doc for doc in results if (result_score(doc) or 0.0) >= self.min_score]
+        return results
+
+    def _within_distance(self, vector_results):
+        """Drop vector hits further than `max_distance`, including any that came back without a distance."""
+        if self.max_distance is None:
+            return vector_results
+        return [
+            doc for doc in vector_results
+            if doc.get("_distance") is not None and doc["_distance"] <= self.max_distance
+        ]
+
+    def _project(self, search, score_column):
+        """Select `columns` plus the search's score column, which lance only adds to an explicit projection on request."""
+        return search.select(list(dict.fromkeys([*self.columns, score_column]))) if self.columns is not None else search
+
+    def _candidates(self):
+        return self.k if self.search_mode != "hybrid" else self.k * DEFAULT_CANDIDATE_FACTOR
+
+    def _fuse(self, vector_results, keyword_results):
+        return reciprocal_rank_fusion(
+            [vector_results, keyword_results],
+            [self.vector_weight, self.keyword_weight],
+            self.k
+        )
+
+    async def _asearch(self, query_embedding, query):
+        if self.search_mode == "keyword":
+            results = await self._akeyword_search(query)
+        elif self.search_mode == "hybrid":
+            # Run both rankers concurrently, then fuse
+            vector_results, keyword_results = await asyncio.gather(
+                self._avector_search(query_embedding),
+                self._akeyword_search(query)
+            )
+            results = self._fuse(self._within_distance(vector_results), keyword_results)
+        else:
+            results = self._within_distance(await self._avector_search(query_embedding))
+        return self._apply_cutoffs(results)
+
+    async def _avector_search(self, query_embedding):
+        params = self._search_params()
+        if self.use_semantic_cache:
+            cached = semantic_cache.get(query_embedding, params)
+            if cached is not None:
+                return cached
+        generation = semantic_cache.generation
+
+        async_collection = await get_async_collection()
+        search = self._project(async_collection.query().nearest_to(query_embedding.tolist()).limit(self._candidates()), "_distance")
+        if self.metric:
+            search = search.distance_type(self.metric)
+        if self.where:
+            search = search.where(self.where)
+        search = index_manager.apply_search_params(search, self.nprobes, self.refine_factor)
+        results = await search.to_list()
+
+        if self.use_semantic_cache:
+            semantic_cache.put(query_embedding, params, results, generation)
+        return results
+
+    async def _akeyword_search(self, query):
+        try:
+            async_collection = await get_async_collection()
+            search = self._project(async_collection.query().nearest_to_text(query).limit(self._candidates()), "_score")
+            if self.where:
+                search = search.where(self.where)
+            return await search.to_list()
+        except Exception as e:
+            logging.warning(f"Full-text search failed, using vector results only: {str(e)}")
+            return []
+
+    def _search(self, query_embedding, query):
+        if self.search_mode == "keyword":
+            results = self._keyword_search(query)
+        elif self.search_mode == "hybrid":
+            # Run both rankers concurrently, then fuse
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                vector_future = executor.submit(self._vector_search, query_embedding)
+                keyword_future = executor.submit(self._keyword_search, query)
+                results = self._fuse(self._within_distance(vector_future.result()), keyword_future.result())
+        else:
+            results = self._within_distance(self._vector_search(query_embedding))
+        return self._apply_cutoffs(results)
+
+    def _vector_search(self, query_embedding):
+        # Near-duplicate queries reuse the results of an earlier search
+        params = self._search_params()
+        if self.use_semantic_cache:
+            cached = semantic_cache.get(query_embedding, params)
+            if cached is not None:
+                return cached
+        generation = semantic_cache.generation
+
+        # Retrieve the top matching chunks, tuning the ANN search if an index exists
+        search = self._project(self.collection.search(query_embedding.tolist()).limit(self._candidates()), "_distance")
+        if self.metric:
+            search = search.distance_type(self.metric)
+        if self.where:
+            search = search.where(self.where, prefilter=True)
+        search = index_manager.apply_search_params(search, self.nprobes, self.refine_factor)
+        results = search.to_list()
+
+        if self.use_semantic_cache:
+            semantic_cache.put(query_embedding, params, results, generation)
+        return results
+
+    def _keyword_search(self, query):
+        # BM25 over original_text, served by the full-text index
+        try:
+            search = self._project(self.collection.search(query, query_type="fts").limit(self._candidates()), "_score")
+            if self.where:
+                search = search.where(self.where, prefilter=True)
+            return search.to_list()
+        except Exception as e:
+            logging.warning(f"Full-text search failed, using vector results only: {str(e)}")
+            return []
+
+
+def result_score(doc):
+    """Score reported for a hit: fused relevance for hybrid, distance for vector and BM25 score for keyword search."""
+    return doc.get("_relevance_score", doc.get("_distance", doc.get("_score", None)))
+
+
+async def _replay(text):
+    for token in split_tokens(text):
+        yield token
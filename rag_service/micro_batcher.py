@@ -0,0 +1,122 @@
+# micro_batcher.py
+import asyncio
+import logging
+import threading
+import time
+
+# Scheduler defaults
+DEFAULT_MAX_BATCH_SIZE = 64  # Texts per coalesced forward pass
+DEFAULT_MAX_WAIT_MS = 5.0  # How long the first request waits for company
+
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+
+class MicroBatcher:
+    """Coalesce concurrent encode requests into one batched call.
+
+    Requests are queued and a single worker task drains the queue. It waits up to
+    `max_wait_ms` after the first request, or until `max_batch_size` texts have
+    arrived, then runs `encode_fn` once over all of them on `executor` and
+    scatters the rows of the result back to each caller.
+    """
+
+    def __init__(self, encode_fn, executor, max_batch_size=DEFAULT_MAX_BATCH_SIZE, max_wait_ms=DEFAULT_MAX_WAIT_MS):
+        self.encode_fn = encode_fn
+        self.executor = executor
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self._queue = None
+        self._worker = None
+        self._metrics_lock = threading.Lock()
+        self._reset_metrics()
+
+    async def submit(self, texts):
+        """Queue a list of texts and wait for their embeddings (a 2-D array, one row per text)."""
+        loop = asyncio.get_running_loop()
+        self._ensure_worker(loop)
+        future = loop.create_future()
+        await self._queue.put((list(texts), future, time.perf_counter()))
+        return await future
+
+    def stats(self):
+        """Return batch-size and queue-latency metrics."""
+        with self._metrics_lock:
+            return {
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait_ms,
+                "batches": self.batches,
+                "requests": self.requests,
+                "texts": self.texts,
+                "mean_batch_size": round(self.texts / self.batches, 2) if self.batches else 0.0,
+                "batch_size_histogram": dict(self.batch_size_histogram),
+                "mean_queue_ms": round(self.queue_seconds / self.requests * 1000, 3) if self.requests else 0.0,
+                "max_queue_ms": round(self.max_queue_seconds * 1000, 3),
+                "queue_depth": self._queue.qsize() if self._queue is not None else 0
+            }
+
+    def _reset_metrics(self):
+        self.batches = 0
+        self.requests = 0
+        self.texts = 0
+        self.queue_seconds = 0.0
+        self.max_queue_seconds = 0.0
+        self.batch_size_histogram = {f"le_{bucket}": 0 for bucket in BATCH_SIZE_BUCKETS}
+        self.batch_size_histogram["le_inf"] = 0
+
+    def _ensure_worker(self, loop):
+        if self._worker is None or self._worker.done() or self._worker.get_loop() is not loop:
+            self._queue = asyncio.Queue()
+            self._worker = loop.create_task(self._run())
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            size = len(batch[0][0])
+            deadline = loop.time() + self.max_wait_ms / 1000
+
+            while size < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                batch.append(item)
+                size += len(item[0])
+
+            await self._process(loop, batch)
+
+    async def _process(self, loop, batch):
+        started = time.perf_counter()
+        self._record(batch, started)
+
+        texts = [text for item_texts, _, _ in batch for text in item_texts]
+        try:
+            vectors = await loop.run_in_executor(self.executor, self.encode_fn, texts)
+        except Exception as e:
+            logging.error(f"Batched encode of {len(texts)} texts failed: {str(e)}")
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        offset = 0
+        for item_texts, future, _ in batch:
+            if not future.done():
+                future.set_result(vectors[offset:offset + len(item_texts)])
+            offset += len(item_texts)
+
+    def _record(self, batch, started):
+        size = sum(len(item_texts) for item_texts, _, _ in batch)
+        bucket = next((f"le_{b}" for b in BATCH_SIZE_BUCKETS if size <= b), "le_inf")
+        with self._metrics_lock:
+            self.batches += 1
+            self.requests += len(batch)
+            self.texts += size
+            self.batch_size_histogram[bucket] += 1
+            for _, _, enqueued in batch:
+                waited = started - enqueued
+                self.queue_seconds += waited
+                self.max_queue_seconds = max(self.max_queue_seconds, waited)
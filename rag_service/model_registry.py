@@ -0,0 +1,132 @@
+# model_registry.py
+import logging
+import os
+import threading
+import time
+
+DEFAULT_MODEL_NAME = "all-MiniLM-L6-v2"
+
+# "torch" is the full-precision reference; "torch_int8" applies dynamic int8
+# quantization to its Linear layers; "onnx" and "onnx_int8" run the ONNX exports
+# shipped with the model through ONNX Runtime (needs `optimum[onnxruntime]`)
+EMBEDDING_BACKENDS = ("torch", "torch_int8", "onnx", "onnx_int8")
+DEFAULT_BACKEND = os.getenv("EMBED_BACKEND", "torch")
+DEFAULT_THREADS = int(os.getenv("EMBED_THREADS", 0)) or None  # Inference threads per process; None lets the runtime decide
+# Quantized ONNX file in the model repository; the AVX2 build runs on any x86-64 server CPU
+ONNX_INT8_FILE = os.getenv("EMBED_ONNX_INT8_FILE", "onnx/model_quint8_avx2.onnx")
+
+_models = {}
+_load_seconds = {}
+_lock = threading.Lock()
+
+
+def model_id(model_name=DEFAULT_MODEL_NAME, backend=DEFAULT_BACKEND):
+    """Name a model/backend pair; the reference backend keeps the bare model name."""
+    return model_name if backend == "torch" else f"{model_name}@{backend}"
+
+
+def get_model(model_name=DEFAULT_MODEL_NAME, backend=DEFAULT_BACKEND, threads=DEFAULT_THREADS):
+    """Return the embedding model `model_name` on `backend`, loading it on first use.
+
+    Every module shares the same instance, so each model is loaded exactly once
+    per process no matter how many callers ask for it.
+    """
+    key = model_id(model_name, backend)
+    model = _models.get(key)
+    if model is not None:
+        return model
+
+    with _lock:
+        if key not in _models:
+            start_time = time.perf_counter()
+            _models[key] = _load(model_name, backend, threads)
+            _load_seconds[key] = time.perf_counter() - start_time
+            logging.info(f"Loaded embedding model '{key}' in {_load_seconds[key]:.2f}s")
+    return _models[key]
+
+
+def _load(model_name, backend, threads):
+    if backend not in EMBEDDING_BACKENDS:
+        raise ValueError(f"Unknown embedding backend '{backend}', expected one of {EMBEDDING_BACKENDS}")
+
+    # Imported here so importing this module does not pull in torch
+    from sentence_transformers import SentenceTransformer
+
+    if backend in ("torch", "torch_int8"):
+        import torch
+
+        if threads:
+            torch.set_num_threads(threads)
+        model = SentenceTransformer(model_name, device="cpu")
+        if backend == "torch_int8":
+            model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        return model
+
+    import onnxruntime
+
+    session_options = onnxruntime.SessionOptions()
+    if threads:
+        session_options.intra_op_num_threads = threads
+    model_kwargs = {"provider": "CPUExecutionProvider", "session_options": session_options}
+    if backend == "onnx_int8":
+        model_kwargs["file_name"] = ONNX_INT8_FILE
+    return SentenceTransformer(model_name, device="cpu", backend="onnx", model_kwargs=model_kwargs)
+
+
+def warm_up(model_name=DEFAULT_MODEL_NAME, backend=DEFAULT_BACKEND):
+    """Load the model and run one encode so the first real request skips lazy initialisation."""
+    start_time = time.perf_counter()
+    get_model(model_name, backend).encode(["warm up"])
+    logging.info(f"Warmed up embedding model '{model_id(model_name, backend)}' in {time.perf_counter() - start_time:.2f}s")
+
+
+def loaded_models():
+    """Return the load time in seconds of every model loaded so far."""
+    return {model_name: round(seconds, 3) for model_name, seconds in _load_seconds.items()}
+
+
+def parity_check(texts, model_name=DEFAULT_MODEL_NAME, backend=DEFAULT_BACKEND, reference_backend="torch",
+                 batch_size=32):
+    """Compare `backend` against the reference backend on `texts`.
+
+    Returns:
+        Dict: Cosine similarity between the two embeddings of each text (mean,
+        min, max drift = 1 - min cosine), the output dimensions and the encode
+        time of each backend.
+    """
+    import numpy as np
+
+    texts = list(texts)
+    if not texts:
+        raise ValueError("Parity check needs at least one text")
+
+    results = {}
+    for name in (reference_backend, backend):
+        model = get_model(model_name, name)
+        model.encode(texts[:1])  # Keep one-off initialisation out of the timing
+        start_time = time.perf_counter()
+        vectors = np.asarray(model.encode(texts, batch_size=batch_size, convert_to_numpy=True), dtype=np.float32)
+        results[name] = (vectors, time.perf_counter() - start_time)
+
+    reference, reference_seconds = results[reference_backend]
+    candidate, candidate_seconds = results[backend]
+    if reference.shape != candidate.shape:
+        raise ValueError(f"Backend '{backend}' returns shape {candidate.shape}, expected {reference.shape}")
+
+    reference = reference / np.maximum(np.linalg.norm(reference, axis=1, keepdims=True), 1e-12)
+    candidate = candidate / np.maximum(np.linalg.norm(candidate, axis=1, keepdims=True), 1e-12)
+    cosines = np.einsum("ij,ij->i", reference, candidate)
+
+    return {
+        "model": model_name,
+        "backend": backend,
+        "reference_backend": reference_backend,
+        "texts": len(texts),
+        "dimension": int(candidate.shape[1]),
+        "mean_cosine": round(float(cosines.mean()), 6),
+        "min_cosine": round(float(cosines.min()), 6),
+        "max_drift": round(float(1.0 - cosines.min()), 6),
+        "reference_seconds": round(reference_seconds, 4),
+        "backend_seconds": round(candidate_seconds, 4),
+        "speedup": round(reference_seconds / candidate_seconds, 2) if candidate_seconds > 0 else None
+    }
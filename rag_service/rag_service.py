@@ -1,150 +1,486 @@
-# rag_service.py
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
-from typing import List, Dict, Any
-import logging
-from db_config import collection, model
-from langchain_pipeline import LangChainRetrievalPipeline
-from embed_documents import process_documents
-# From warning messages on application startup
-# from langchain.llms import OpenAI
-from langchain_community.llms import OpenAI
-
-
-
-# Initialize FastAPI app, model, and LanceDB
-app = FastAPI()
-
-# Initialize logging
-logging.basicConfig(level=logging.INFO)  # Set logging level to INFO
-
-# Initialize the LangChain pipeline
-# langchain_pipeline = LangChainRetrievalPipeline(collection)
-
-# Define request and response models
-class TextRequest(BaseModel):
-    text: str
-
-class RetrievalRequest(BaseModel):
-    query: str
-    api_key: str  # Add API key to the request model
-
-class EnhancedPromptResponse(BaseModel):
-    enhanced_prompt: str
-    llm_response: str
-    documents_used: List[Dict[str, Any]]
-
-@app.post("/embed/")
-def create_embedding(request: TextRequest):
-    embedding = model.encode(request.text).tolist()  # Convert to list for JSON compatibility
-    return {"embedding": embedding}
-
-@app.post("/store/")
-def store_embedding(request: TextRequest):
-    try:
-        embedding = model.encode(request.text).tolist()  # Convert to list for storage
-        data = {
-            "text_id": request.text,
-            "vector": embedding,
-            "original_text": request.text
-        }
-
-        logging.info(f"Storing data in the collection: {data}")
-
-        collection.add([data])  # Use add method with a list of dictionaries
-
-        return {"status": "stored", "text_id": request.text}
-    except Exception as e:
-        logging.error(f"Error in store_embedding: {str(e)}")
-        raise HTTPException(status_code=500, detail=str(e))
-
-# **TODO 1**: Implement the `retrieve_and_enhance` function to process an incoming query, retrieve contextually relevant documents, enhance the prompt, and fetch a response from the language model.
-# ```plaintext
-# pseudocode:
-# 1. **Initialize Language Model**:
-#    - Extract the API key from the incoming request data to authenticate with the language model.
-#    - Create an `llm_model` instance using the extracted API key, enabling the function to query the model securely.
-# 2. **Set Up Retrieval Pipeline**:
-#    - Instantiate a `LangChainRetrievalPipeline` with two main components:
-#      - `collection`, which references the document storage system for retrieving contextually relevant documents.
-#      - `llm_model`, the language model that will generate responses based on enhanced prompts.
-# 3. **Retrieve and Enhance Prompt**:
-#    - Call the `retrieve_and_enhance` method of `langchain_pipeline`, passing in the query from the request data.
-#    - This method retrieves the most relevant documents, formats them into a coherent context, and combines them with the user query to create an enhanced prompt.
-# 4. **Return Structured Response**:
-#    - Package the output from `retrieve_and_enhance` into a structured response containing:
-#      - `enhanced_prompt`: the modified prompt incorporating relevant document context.
-#      - `llm_response`: the generated response from the language model.
-#      - `documents_used`: metadata on the documents used to create context, aiding in traceability and context clarity.
-# 5. **Error Handling**:
-#    - Enclose the entire logic in a try-except block to handle unexpected issues.
-#    - Log errors and raise an HTTP 500 error with details to ensure troubleshooting and debugging are efficient.
-# ```
-
-@app.post("/enhanced_retrieve/")
-def retrieve_and_enhance(request: RetrievalRequest) -> EnhancedPromptResponse:
-    try:
-        print('INITIALIZING OPEN AI')
-
-        # Initialize the Language Model
-        llm_model = OpenAI(api_key=request.api_key)
-
-        print('LLM MODEL')
-        print(llm_model)
-
-        # Set Up Retrieval Pipeline
-        langchain_pipeline = LangChainRetrievalPipeline(collection, llm_model)
-
-        print('LANGCHAIN PIPELINE')
-        print(langchain_pipeline)
-
-        # Retrieve and Enhance Prompt
-        enhanced_prompt, llm_response, documents_used = langchain_pipeline.retrieve_and_enhance(request.query)
-
-        print('LLM RESPONSE')
-        print(llm_response)
-
-        # Return Structured Response
-        return EnhancedPromptResponse(enhanced_prompt=enhanced_prompt, llm_response=llm_response, documents_used=documents_used)
-    except Exception as e:
-        logging.error(f"Error in retrieve_and_enhance: {str(e)}")
-        raise HTTPException(status_code=500, detail=str(e))
-
-@app.post("/embed_all_documents/")
-def embed_all_documents():
-    process_documents()  # Call the function from embed_documents.py
-    return {"status": "Documents embedded and stored successfully"}
-
-@app.post("/clear_embeddings/")
-def clear_embeddings():
-    try:
-        collection.delete(where="True")  # "True" matches all rows, effectively clearing the table
-        return {"status": "Embeddings cleared successfully"}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
-
-# Debugging endpoints
-
-@app.get("/check_embeddings/")
-def check_embeddings():
-    try:
-        # Use count_rows to count the records in the collection
-        num_embeddings = collection.count_rows()
-        return {"number_of_embeddings": num_embeddings}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
-
-
-@app.get("/sample_embedding/")
-def sample_embedding():
-    try:
-        # Use scanner to retrieve a sample of records
-        sample = []
-        for i, record in enumerate(collection.scanner()):
-            if i >= 5:  # Limit to first 5 records for sampling
-                break
-            sample.append(record)
-        return {"sample_embeddings": sample}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e)) 
-
+# rag_service.py
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
+from pydantic import BaseModel
+from typing import List, Dict, Any, Optional
+import asyncio
+import json
+import logging
+import os
+
+# Initialize logging once for the service, before the imports below log while opening the database.
+# Library modules only create log records, so LOG_LEVEL=DEBUG adds per-request details and timings
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper())
+
+from functools import lru_cache
+from contextlib import asynccontextmanager
+from db_config import collection, embedding_backend, embedding_cache, index_manager, model_name, semantic_cache
+from model_registry import warm_up, loaded_models, parity_check
+from rag_common.generation_cache import get_generation_cache
+from rag_common.stage_timing import StageTimer, registry
+from async_db import get_async_collection
+from langchain_pipeline import LangChainRetrievalPipeline, result_score
+from embed_documents import process_documents, sync_documents, reset_manifest, get_ingest_progress
+# From warning messages on application startup
+# from langchain.llms import OpenAI
+from rag_common.llm_backends import create_llm, DEFAULT_BACKEND
+
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Open the async table and load the embedding model up front so the first request doesn't pay for them
+    await get_async_collection()
+    await asyncio.get_running_loop().run_in_executor(None, warm_up, model_name, embedding_backend)
+    yield
+
+# Initialize FastAPI app, model, and LanceDB
+app = FastAPI(lifespan=lifespan)
+
+# Initialize the LangChain pipeline
+# langchain_pipeline = LangChainRetrievalPipeline(collection)
+
+@lru_cache(maxsize=16)
+def get_llm(api_key: str, bypass_cache: bool = False):
+    """Return a shared LLM client per API key so its connection pool is reused.
+
+    The backend (OpenAI, a local OpenAI-compatible server or the offline fake)
+    comes from the `LLM_BACKEND` environment variable. Generations are served
+    from the shared SQLite cache unless `bypass_cache` is set.
+    """
+    return create_llm(api_key, DEFAULT_BACKEND, cache=False if bypass_cache else get_generation_cache())
+
+# Define request and response models
+class TextRequest(BaseModel):
+    text: str
+
+class TextsRequest(BaseModel):
+    texts: List[str]
+
+class RetrievalRequest(BaseModel):
+    query: str
+    api_key: str  # Add API key to the request model
+    bypass_cache: bool = False  # Always call the LLM, even for a cached prompt
+    k: int = 5
+    nprobes: Optional[int] = None  # IVF partitions to probe (ignored without an index)
+    refine_factor: Optional[int] = None  # Re-rank k * refine_factor candidates with exact distances
+    search_mode: str = "vector"  # "vector", "keyword" (BM25) or "hybrid" (reciprocal-rank fusion of both)
+    vector_weight: float = 1.0  # Hybrid weight of the vector ranking
+    keyword_weight: float = 1.0  # Hybrid weight of the keyword ranking
+    filters: Optional[Dict[str, Any]] = None  # Metadata pre-filters, e.g. {"category": "job_descriptions"}
+    token_budget: int = 1500  # Maximum tokens of retrieved context in the prompt
+    dedup_threshold: float = 0.95  # Passages at least this similar to a chosen one are dropped
+    mmr_lambda: Optional[float] = None  # Set (0-1) to diversify passages with MMR; 1.0 is pure relevance
+    include_timings: bool = False  # Add per-stage timings (ms) to the response
+
+class RetrieveRequest(BaseModel):
+    query: str
+    k: int = 5
+    metric: Optional[str] = None  # "l2", "cosine" or "dot"; defaults to the table's metric (L2)
+    max_distance: Optional[float] = None  # Drop vector hits further than this
+    min_score: Optional[float] = None  # Drop keyword/hybrid hits scored below this
+    # Columns returned beside text_id, snippet and score
+    columns: List[str] = ["doc_id", "chunk_index", "category", "source_file", "doc_date"]
+    include_vector: bool = False  # Return each hit's embedding too
+    nprobes: Optional[int] = None
+    refine_factor: Optional[int] = None
+    search_mode: str = "vector"
+    vector_weight: float = 1.0
+    keyword_weight: float = 1.0
+    filters: Optional[Dict[str, Any]] = None
+    include_timings: bool = False
+
+class BatchRetrieveRequest(RetrieveRequest):
+    query: Optional[str] = None
+    queries: List[str]
+
+class BatchRetrievalRequest(RetrievalRequest):
+    query: Optional[str] = None
+    queries: List[str]
+    max_concurrency: int = 8  # Maximum LLM calls in flight at once
+
+class BatchRetrievalItem(BaseModel):
+    query: str
+    enhanced_prompt: Optional[str] = None
+    llm_response: Optional[str] = None
+    documents_used: List[Dict[str, Any]] = []
+    error: Optional[str] = None
+
+class BatchRetrievalResponse(BaseModel):
+    results: List[BatchRetrievalItem]
+    timings: Optional[Dict[str, float]] = None
+
+class ParityRequest(BaseModel):
+    backend: Optional[str] = None  # Backend to check; defaults to the one in use
+    texts: Optional[List[str]] = None  # Defaults to a sample of stored chunks
+    sample_size: int = 64
+
+class RebuildIndexRequest(BaseModel):
+    index_type: Optional[str] = None  # FLAT, IVF_HNSW_SQ or IVF_PQ; chosen from the row count if omitted
+
+class EnhancedPromptResponse(BaseModel):
+    enhanced_prompt: str
+    llm_response: str
+    documents_used: List[Dict[str, Any]]
+    timings: Optional[Dict[str, float]] = None  # Per-stage milliseconds, when requested
+
+class EmbedAllRequest(BaseModel):
+    write_batch_size: int = 1024
+    encode_batch_size: int = 64
+    num_workers: Optional[int] = None
+    compact: bool = True
+    chunk_strategy: str = "sentence"
+    chunk_size: int = 128
+    chunk_overlap: int = 32
+    num_processes: Optional[int] = None  # > 1 chunks and encodes in that many processes
+
+@app.post("/embed/")
+async def create_embedding(request: TextRequest):
+    embedding = (await embedding_cache.aencode(request.text)).tolist()  # Convert to list for JSON compatibility
+    return {"embedding": embedding}
+
+@app.post("/embed_batch/")
+async def create_embeddings(request: TextsRequest):
+    embeddings = await embedding_cache.aencode(request.texts)
+    return {"embeddings": embeddings.tolist()}
+
+@app.post("/store/")
+async def store_embedding(request: TextRequest):
+    try:
+        embedding = (await embedding_cache.aencode(request.text)).tolist()  # Convert to list for storage
+        data = {
+            "text_id": request.text,
+            "vector": embedding,
+            "original_text": request.text,
+            "doc_id": request.text,
+            "chunk_index": 0,
+            "start_offset": 0,
+            "end_offset": len(request.text),
+            "category": None,
+            "source_file": None,
+            "doc_date": None
+        }
+
+        logging.debug(f"Storing a {len(request.text)}-character text in the collection")
+
+        async_collection = await get_async_collection()
+        await async_collection.add([data])  # Use add method with a list of dictionaries
+        semantic_cache.invalidate()
+
+        return {"status": "stored", "text_id": request.text}
+    except Exception as e:
+        logging.error(f"Error in store_embedding: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+def _retrieval_pipeline(request: RetrieveRequest, timer: StageTimer) -> LangChainRetrievalPipeline:
+    """Build an LLM-free pipeline that reads only the columns the caller asked for."""
+    columns = ["original_text", *request.columns] + (["vector"] if request.include_vector else [])
+    return LangChainRetrievalPipeline(
+        collection,
+        None,
+        k=request.k,
+        nprobes=request.nprobes,
+        refine_factor=request.refine_factor,
+        search_mode=request.search_mode,
+        vector_weight=request.vector_weight,
+        keyword_weight=request.keyword_weight,
+        filters=request.filters,
+        timer=timer,
+        metric=request.metric,
+        columns=columns,
+        max_distance=request.max_distance,
+        min_score=request.min_score
+    )
+
+def _retrieval_results(top_docs: List[Dict[str, Any]], request: RetrieveRequest) -> List[Dict[str, Any]]:
+    results = []
+    for doc in top_docs:
+        result = {"text_id": doc["text_id"], "snippet": doc["original_text"], "score": result_score(doc)}
+        result.update({column: doc.get(column) for column in request.columns})
+        if request.include_vector:
+            result["vector"] = [float(value) for value in doc["vector"]]
+        results.append(result)
+    return results
+
+def _enhance_pipeline(request: RetrievalRequest, timer: StageTimer) -> LangChainRetrievalPipeline:
+    """Build the retrieval + generation pipeline shared by the enhanced_retrieve endpoints."""
+    return LangChainRetrievalPipeline(
+        collection,
+        get_llm(request.api_key, request.bypass_cache),
+        k=request.k,
+        nprobes=request.nprobes,
+        refine_factor=request.refine_factor,
+        search_mode=request.search_mode,
+        vector_weight=request.vector_weight,
+        keyword_weight=request.keyword_weight,
+        filters=request.filters,
+        token_budget=request.token_budget,
+        dedup_threshold=request.dedup_threshold,
+        mmr_lambda=request.mmr_lambda,
+        timer=timer
+    )
+
+@app.post("/retrieve/")
+async def retrieve(request: RetrieveRequest):
+    """Rank chunks for a query without calling the LLM."""
+    timer = StageTimer("retrieve")
+    try:
+        langchain_pipeline = _retrieval_pipeline(request, timer)
+        top_docs = await langchain_pipeline.aretrieve(request.query)
+        response = {"results": _retrieval_results(top_docs, request)}
+        if request.include_timings:
+            response["timings"] = timer.as_ms()
+        return response
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logging.error(f"Error in retrieve: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/retrieve_batch/")
+async def retrieve_batch(request: BatchRetrieveRequest):
+    """Rank chunks for many queries in one call; queries are embedded together and searched concurrently."""
+    timer = StageTimer("retrieve_batch")
+    try:
+        langchain_pipeline = _retrieval_pipeline(request, timer)
+        retrieved = await langchain_pipeline.aretrieve_batch(request.queries) if request.queries else []
+        response = {"results": [_retrieval_results(top_docs, request) for top_docs in retrieved]}
+        if request.include_timings:
+            response["timings"] = timer.as_ms()
+        return response
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logging.error(f"Error in retrieve_batch: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+# **TODO 1**: Implement the `retrieve_and_enhance` function to process an incoming query, retrieve contextually relevant documents, enhance the prompt, and fetch a response from the language model.
+# ```plaintext
+# pseudocode:
+# 1. **Initialize Language Model**:
+#    - Extract the API key from the incoming request data to authenticate with the language model.
+#    - Create an `llm_model` instance using the extracted API key, enabling the function to query the model securely.
+# 2. **Set Up Retrieval Pipeline**:
+#    - Instantiate a `LangChainRetrievalPipeline` with two main components:
+#      - `collection`, which references the document storage system for retrieving contextually relevant documents.
+#      - `llm_model`, the language model that will generate responses based on enhanced prompts.
+# 3. **Retrieve and Enhance Prompt**:
+#    - Call the `retrieve_and_enhance` method of `langchain_pipeline`, passing in the query from the request data.
+#    - This method retrieves the most relevant documents, formats them into a coherent context, and combines them with the user query to create an enhanced prompt.
+# 4. **Return Structured Response**:
+#    - Package the output from `retrieve_and_enhance` into a structured response containing:
+#      - `enhanced_prompt`: the modified prompt incorporating relevant document context.
+#      - `llm_response`: the generated response from the language model.
+#      - `documents_used`: metadata on the documents used to create context, aiding in traceability and context clarity.
+# 5. **Error Handling**:
+#    - Enclose the entire logic in a try-except block to handle unexpected issues.
+#    - Log errors and raise an HTTP 500 error with details to ensure troubleshooting and debugging are efficient.
+# ```
+
+@app.post("/enhanced_retrieve/")
+async def retrieve_and_enhance(request: RetrievalRequest) -> EnhancedPromptResponse:
+    timer = StageTimer("enhanced_retrieve")
+    try:
+        with timer.stage("total"):
+            # Set Up Retrieval Pipeline with the Language Model
+            langchain_pipeline = _enhance_pipeline(request, timer)
+            logging.debug(
+                f"Retrieving with {type(langchain_pipeline.llm_model).__name__}, "
+                f"mode={request.search_mode}, k={request.k}"
+            )
+
+            # Retrieve and Enhance Prompt
+            result = await langchain_pipeline.aretrieve_and_enhance(request.query)
+
+        logging.debug(f"Enhanced retrieval used {len(result['documents_used'])} documents, timings (ms): {timer.as_ms()}")
+
+        # Return Structured Response, serialized here so the time it takes is measured too
+        with timer.stage("serialize"):
+            response = EnhancedPromptResponse(**result, timings=timer.as_ms() if request.include_timings else None)
+            body = response.model_dump_json()
+        return Response(body, media_type="application/json")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logging.error(f"Error in retrieve_and_enhance: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/enhanced_retrieve_stream/")
+async def retrieve_and_enhance_stream(request: RetrievalRequest) -> StreamingResponse:
+    """Stream the RAG pipeline as newline-delimited JSON events.
+
+    The `context` event (enhanced prompt and documents) is sent as soon as
+    retrieval finishes, followed by `token` events as the LLM generates and a
+    final `done` event. A failure after the stream has started is reported as an
+    `error` event, since the status code has already been sent.
+    """
+    timer = StageTimer("enhanced_retrieve_stream")
+    try:
+        langchain_pipeline = _enhance_pipeline(request, timer)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    async def events():
+        try:
+            async for event in langchain_pipeline.astream_retrieve_and_enhance(request.query):
+                if event["event"] == "done" and request.include_timings:
+                    event["timings"] = timer.as_ms()
+                yield json.dumps(event) + "\n"
+        except Exception as e:
+            logging.error(f"Error in retrieve_and_enhance_stream: {str(e)}")
+            yield json.dumps({"event": "error", "detail": str(e)}) + "\n"
+
+    return StreamingResponse(events(), media_type="application/x-ndjson")
+
+@app.post("/enhanced_retrieve_batch/")
+async def retrieve_and_enhance_batch(request: BatchRetrievalRequest) -> BatchRetrievalResponse:
+    timer = StageTimer("enhanced_retrieve_batch")
+    try:
+        langchain_pipeline = _enhance_pipeline(request, timer)
+        results = await langchain_pipeline.aretrieve_and_enhance_batch(request.queries, request.max_concurrency)
+        return BatchRetrievalResponse(
+            results=[BatchRetrievalItem(**result) for result in results],
+            timings=timer.as_ms() if request.include_timings else None
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logging.error(f"Error in retrieve_and_enhance_batch: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/embed_all_documents/")
+def embed_all_documents(request: Optional[EmbedAllRequest] = None):
+    request = request or EmbedAllRequest()
+    options = request.model_dump(exclude_none=True)
+    stats = process_documents(**options)  # Call the function from embed_documents.py
+    return {"status": "Documents embedded and stored successfully", "stats": stats}
+
+@app.post("/sync_documents/")
+def sync_all_documents(request: Optional[EmbedAllRequest] = None):
+    request = request or EmbedAllRequest()
+    options = request.model_dump(exclude_none=True)
+    stats = sync_documents(**options)  # Only new, changed or removed documents are touched
+    return {"status": "Documents synced successfully", "stats": stats}
+
+@app.post("/clear_embeddings/")
+def clear_embeddings():
+    try:
+        collection.delete(where="True")  # "True" matches all rows, effectively clearing the table
+        reset_manifest()  # Next sync must re-embed everything
+        semantic_cache.invalidate()
+        index_manager.maybe_rebuild()  # An empty table goes back to flat search
+        return {"status": "Embeddings cleared successfully"}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Debugging endpoints
+
+@app.get("/check_embeddings/")
+async def check_embeddings():
+    try:
+        # Use count_rows to count the records in the collection
+        async_collection = await get_async_collection()
+        num_embeddings = await async_collection.count_rows()
+        return {"number_of_embeddings": num_embeddings}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/index_status/")
+def index_status():
+    try:
+        return index_manager.status()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/rebuild_index/")
+def rebuild_index(request: Optional[RebuildIndexRequest] = None):
+    try:
+        request = request or RebuildIndexRequest()
+        return index_manager.build(request.index_type)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/embedding_cache_stats/")
+def embedding_cache_stats():
+    return {**embedding_cache.stats(), "model_load_seconds": loaded_models()}
+
+
+@app.get("/ingest_progress/")
+def ingest_progress():
+    return get_ingest_progress()
+
+
+@app.get("/semantic_cache_stats/")
+def semantic_cache_stats():
+    return semantic_cache.stats()
+
+
+@app.get("/generation_cache_stats/")
+def generation_cache_stats():
+    return get_generation_cache().stats()
+
+
+@app.get("/embedding_scheduler_stats/")
+def embedding_scheduler_stats():
+    return embedding_cache.batcher.stats()
+
+
+def _cache_lookups():
+    generation = get_generation_cache()
+    return {
+        (("cache", "embedding"), ("result", "hit")): embedding_cache.memory_hits + embedding_cache.disk_hits,
+        (("cache", "embedding"), ("result", "miss")): embedding_cache.misses,
+        (("cache", "semantic"), ("result", "hit")): semantic_cache.hits,
+        (("cache", "semantic"), ("result", "miss")): semantic_cache.misses,
+        (("cache", "generation"), ("result", "hit")): generation.hits,
+        (("cache", "generation"), ("result", "miss")): generation.misses
+    }
+
+
+registry.counter("rag_cache_lookups_total", "Cache lookups since startup, by cache and result.", _cache_lookups)
+registry.gauge("rag_embedding_queue_depth", "Encode requests waiting for the micro-batcher.",
+               lambda: embedding_cache.batcher.stats()["queue_depth"])
+registry.gauge("rag_collection_rows", "Rows in the embeddings table.", collection.count_rows)
+
+
+@app.post("/embedding_parity/")
+def embedding_parity(request: Optional[ParityRequest] = None):
+    """Report the cosine drift of an embedding backend against the full-precision reference model."""
+    request = request or ParityRequest()
+    try:
+        texts = request.texts
+        if not texts:
+            rows = collection.search().select(["original_text"]).limit(request.sample_size).to_list()
+            texts = [row["original_text"] for row in rows] or ["What is the parental leave policy?"]
+        return parity_check(texts, model_name, request.backend or embedding_backend)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logging.error(f"Error in embedding_parity: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/metrics")
+def metrics():
+    """Stage latency histograms and cache counters in the Prometheus text format."""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/sample_embedding/")
+def sample_embedding():
+    try:
+        # Use scanner to retrieve a sample of records
+        sample = []
+        for i, record in enumerate(collection.scanner()):
+            if i >= 5:  # Limit to first 5 records for sampling
+                break
+            sample.append(record)
+        return {"sample_embeddings": sample}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e)) 
+
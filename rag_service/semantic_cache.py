@@ -0,0 +1,79 @@
+# semantic_cache.py
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+# Semantic cache defaults
+DEFAULT_MAX_DISTANCE = 0.1  # Cosine distance under which two queries share results
+DEFAULT_MAX_ENTRIES = 1024
+
+
+class SemanticQueryCache:
+    """Reuse search results for queries whose embeddings are nearly identical.
+
+    Entries are grouped by search parameters (k, nprobes, filters, ...), so a hit
+    always has the same result shape as the search it replaces. `invalidate` must
+    be called whenever the table changes. Each invalidation bumps `generation`,
+    and results from a search that started before it are never stored.
+    """
+
+    def __init__(self, max_distance=DEFAULT_MAX_DISTANCE, max_entries=DEFAULT_MAX_ENTRIES):
+        self.max_distance = max_distance
+        self.max_entries = max_entries
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # (params, id) -> (unit vector, results)
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    def get(self, query_embedding, params):
+        """Return cached results for the closest cached query within `max_distance`, or None."""
+        query = _normalize(query_embedding)
+        with self._lock:
+            keys = [key for key in self._entries if key[0] == params]
+            if keys:
+                vectors = np.stack([self._entries[key][0] for key in keys])
+                similarities = vectors @ query
+                best = int(np.argmax(similarities))
+                if 1.0 - similarities[best] <= self.max_distance:
+                    self._entries.move_to_end(keys[best])
+                    self.hits += 1
+                    return self._entries[keys[best]][1]
+            self.misses += 1
+            return None
+
+    def put(self, query_embedding, params, results, generation):
+        """Cache `results`, unless the table changed since `generation` was read."""
+        with self._lock:
+            if generation != self.generation:
+                return
+            self._entries[(params, self._next_id)] = (_normalize(query_embedding), results)
+            self._next_id += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self):
+        """Drop every cached result; call after any write to the table."""
+        with self._lock:
+            self._entries.clear()
+            self.generation += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "max_distance": self.max_distance,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "generation": self.generation
+            }
+
+
+def _normalize(vector):
+    vector = np.asarray(vector, dtype=np.float32)
+    return vector / max(float(np.linalg.norm(vector)), 1e-12)